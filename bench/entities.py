@@ -0,0 +1,104 @@
+"""
+Memory and property read cost of the Konke power strip entities.
+
+Builds power strips with their outlet and usb entities on top of fake
+devices and reports the memory per strip and the cost of reading the
+properties Home Assistant reads on every state write.
+
+usage: python bench/entities.py [--strips 500] [--reads 20]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from custom_components.switch import konke as switch  # noqa: E402
+
+SOCKET_COUNT = 4
+USB_COUNT = 3
+
+
+class FakeDevice(object):
+    """Device with the state attributes of a mul power strip."""
+
+    def __init__(self, index):
+        """Initialize the device."""
+        self.ip = '127.0.%d.%d' % (index // 250, index % 250 + 1)
+        self.uuid = '%012x' % index
+        self.is_online = True
+        self.socket_count = SOCKET_COUNT
+        self.usb_count = USB_COUNT
+        self.status = ['open' if i % 2 else 'close' for i in range(SOCKET_COUNT)]
+        self.usb_status = ['close'] * USB_COUNT
+
+
+class FakeCoordinator(object):
+    """Coordinator that only keeps its listeners."""
+
+    def __init__(self, device):
+        """Initialize the coordinator."""
+        self.device = device
+        self.listeners = []
+
+    def async_add_listener(self, update_callback, fields=None):
+        """Subscribe a callback."""
+        self.listeners.append(update_callback)
+
+    def async_remove_listener(self, update_callback):
+        """Unsubscribe a callback."""
+        self.listeners.remove(update_callback)
+
+
+def build(strips):
+    """Create strips power strips with all their entities."""
+    powerstrips = []
+    for index in range(strips):
+        powerstrip = switch.KonkePowerStrip(FakeCoordinator(FakeDevice(index)), 'strip_%d' % index)
+        entities = [switch.KonkePowerStripOutlet(powerstrip, 'strip_%d' % index, i)
+                    for i in range(SOCKET_COUNT)]
+        entities.extend(switch.KonkePowerStripUSB(powerstrip, 'strip_%d' % index, i)
+                        for i in range(USB_COUNT))
+        powerstrip.entities = entities
+        for entity in entities:
+            # Attributes Home Assistant sets when it adds an entity.
+            entity.hass = None
+            entity.entity_id = 'switch.%s' % entity.name
+            entity.platform = None
+            powerstrip.async_add_listener(entity.async_schedule_update_ha_state)
+        powerstrips.append(powerstrip)
+    return powerstrips
+
+
+def main():
+    """Parse the arguments and run the benchmark."""
+    parser = argparse.ArgumentParser(description='Benchmark the Konke power strip entities.')
+    parser.add_argument('--strips', type=int, default=500, help='number of power strips')
+    parser.add_argument('--reads', type=int, default=20, help='state writes per entity')
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    powerstrips = build(args.strips)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    entities = [entity for powerstrip in powerstrips for entity in powerstrip.entities]
+    start = time.perf_counter()
+    for _ in range(args.reads):
+        for entity in entities:
+            entity.unique_id
+            entity.name
+            entity.is_on
+            entity.available
+    elapsed = time.perf_counter() - start
+
+    print('strips / entities:       %d / %d' % (len(powerstrips), len(entities)))
+    print('memory per strip:        %.0f bytes' % ((after - before) / len(powerstrips)))
+    print('state read per entity:   %.2f us' % (elapsed / (args.reads * len(entities)) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
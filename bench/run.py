@@ -0,0 +1,185 @@
+"""
+Benchmark of the Konke platforms against a simulated device fleet.
+
+Sets up the real switch, light and remote platforms against simulated
+devices and reports updates/sec, command latency, event loop lag and the
+packets sent per entity per minute while idle.
+
+usage: python bench/run.py [--devices 100] [--duration 60] [--latency 0.005]
+                           [--loss 0.0] [--offline 0.0] [--push]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from homeassistant.core import HomeAssistant  # noqa: E402
+
+import custom_components.konke as konke  # noqa: E402
+from custom_components.light import konke as light  # noqa: E402
+from custom_components.remote import konke as remote  # noqa: E402
+from custom_components.switch import konke as switch  # noqa: E402
+from simulator import SimulatedFleet  # noqa: E402
+
+COMMAND_SAMPLES = 200
+LAG_INTERVAL = 0.01
+
+
+def percentile(values, fraction):
+    """Return a percentile of values."""
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def platform_configs(device):
+    """Return (platform module, domain, config) of the entities of a device."""
+    config = {'name': 'konke_%s' % device.ip.replace('.', '_'), 'host': device.ip, 'model': device.model}
+    if device.model in ('klight', 'kbulb'):
+        return [(light, 'light', config)]
+    configs = [(switch, 'switch', config)]
+    if device.model == 'k2':
+        configs.append((light, 'light', dict(config, name=config['name'] + '_light', model='k2_light')))
+        configs.append((remote, 'remote', dict(config, name=config['name'] + '_ir', type='ir', hidden=True)))
+    return configs
+
+
+class LagMonitor(object):
+    """Measure how late the event loop wakes up."""
+
+    def __init__(self, loop):
+        """Initialize the monitor."""
+        self._loop = loop
+        self.lags = []
+        self._task = None
+
+    def start(self):
+        """Start measuring."""
+        self._task = self._loop.create_task(self._async_run())
+
+    def stop(self):
+        """Stop measuring."""
+        self._task.cancel()
+
+    async def _async_run(self):
+        """Sleep repeatedly and record the overshoot."""
+        while True:
+            start = self._loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lags.append(self._loop.time() - start - LAG_INTERVAL)
+
+
+async def async_run(args):
+    """Run the benchmark."""
+    loop = asyncio.get_event_loop()
+    fleet = SimulatedFleet(args.devices, latency=args.latency, loss=args.loss)
+    for device in fleet.devices[:int(len(fleet.devices) * args.offline)]:
+        device.offline = True
+    await fleet.async_start(loop)
+
+    hass = HomeAssistant(loop)
+    hass.config.config_dir = tempfile.mkdtemp()
+    await konke.async_setup(hass, {konke.DOMAIN: konke.DOMAIN_SCHEMA({konke.CONF_PUSH: args.push})})
+
+    monitor = LagMonitor(loop)
+    monitor.start()
+
+    entities = []
+    first_state = {}
+    last_added = [0.0]
+    setup_start = time.monotonic()
+
+    def add_entities_callback(domain):
+        def async_add_entities(new_entities, update_before_add=False):
+            for entity in new_entities:
+                entity.hass = hass
+                entity.entity_id = '%s.konke_%s' % (domain, len(entities))
+                entities.append(entity)
+                hass.async_add_job(entity.async_added_to_hass())
+            first_state.setdefault(domain, time.monotonic() - setup_start)
+            last_added[0] = time.monotonic() - setup_start
+        return async_add_entities
+
+    platforms = 0
+    for device in fleet.devices:
+        for module, domain, config in platform_configs(device):
+            platforms += 1
+            config = module.PLATFORM_SCHEMA(dict(config, platform='konke'))
+            await module.async_setup_platform(hass, config, add_entities_callback(domain))
+    setup_time = time.monotonic() - setup_start
+
+    # The platforms add their entities from jobs tracked by hass, once the
+    # device is probed or PROBE_TIMEOUT passed.
+    await hass.async_block_till_done()
+    ready_time = last_added[0]
+
+    # Scheduled polls, confirm refreshes and heartbeats only fire from the
+    # timer started with hass.
+    await hass.async_start()
+
+    rounds = 3
+    start = time.monotonic()
+    for _ in range(rounds):
+        await asyncio.gather(*[entity.async_update() for entity in entities])
+    updates_per_sec = len(entities) * rounds / (time.monotonic() - start)
+
+    latencies = []
+    commandable = [entity for entity in entities if not isinstance(entity, remote.KonkeRemote)]
+    for index in range(min(COMMAND_SAMPLES, len(commandable))):
+        entity = commandable[index]
+        start = time.monotonic()
+        try:
+            if index % 2:
+                await entity.async_turn_off()
+            else:
+                await entity.async_turn_on()
+        except Exception:  # pylint: disable=broad-except
+            continue
+        latencies.append(time.monotonic() - start)
+
+    await asyncio.sleep(2)
+    packets = fleet.packets
+    await asyncio.sleep(args.duration)
+    idle_packets = fleet.packets - packets
+
+    monitor.stop()
+    fleet.stop()
+
+    print('devices:                 %d (%d offline)' % (len(fleet.devices), int(len(fleet.devices) * args.offline)))
+    print('entities:                %d of %d platforms' % (len(entities), platforms))
+    print('platform setup:          %.3f s' % setup_time)
+    print('all entities added:      %.3f s' % ready_time)
+    for domain, elapsed in sorted(first_state.items()):
+        print('first %-18s %.3f s' % (domain + ':', elapsed))
+    print('updates/sec:             %.1f' % updates_per_sec)
+    print('command latency p50/p99: %.1f / %.1f ms' % (
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000))
+    print('loop lag p50/p99/max:    %.1f / %.1f / %.1f ms' % (
+        percentile(monitor.lags, 0.5) * 1000, percentile(monitor.lags, 0.99) * 1000,
+        max(monitor.lags, default=0) * 1000))
+    print('packets/entity/minute:   %.2f' % (
+        idle_packets / max(len(entities), 1) / (args.duration / 60)))
+
+
+def main():
+    """Parse the arguments and run the benchmark."""
+    parser = argparse.ArgumentParser(description='Benchmark the Konke platforms against simulated devices.')
+    parser.add_argument('--devices', type=int, default=100, help='number of simulated devices')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of idle traffic measured')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds before a device answers')
+    parser.add_argument('--loss', type=float, default=0.0, help='fraction of requests dropped')
+    parser.add_argument('--offline', type=float, default=0.0, help='fraction of devices offline')
+    parser.add_argument('--push', action='store_true', help='enable the heartbeat listener')
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(async_run(args))
+
+
+if __name__ == '__main__':
+    main()
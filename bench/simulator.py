@@ -0,0 +1,166 @@
+"""
+Simulated fleet of Konke devices.
+
+Every simulated device listens on its own loopback address on the Konke
+LAN port and answers the requests of pykonkeio like the real device
+would, with configurable latency, packet loss and offline behaviour.
+"""
+import asyncio
+import logging
+import random
+
+from pykonkeio import utils
+
+_LOGGER = logging.getLogger(__name__)
+
+PORT = 27431
+
+MODELS = ('k1', 'k2', 'minik', 'mul', 'micmul', 'klight', 'kbulb')
+
+SOCKET_COUNT = {'mul': 3, 'micmul': 4}
+USB_COUNT = {'mul': 2}
+
+
+class SimulatedDevice(asyncio.DatagramProtocol):
+    """One simulated Konke device."""
+
+    def __init__(self, ip, model, latency=0.005, loss=0.0, offline=False):
+        """Initialize the simulated device."""
+        self.ip = ip
+        self.model = model
+        self.mac = '28-d9-8a-%02x-%02x-%02x' % tuple(int(part) for part in ip.split('.')[1:])
+        self.password = 'nopassword'
+        self.latency = latency
+        self.loss = loss
+        self.offline = offline
+        self.packets = 0
+        self.relay = ['close'] * SOCKET_COUNT.get(model, 1)
+        self.usb = ['close'] * USB_COUNT.get(model, 1)
+        self.light = 'close'
+        self.color = [255, 255, 255]
+        self.brightness = 50
+        self.ct = 4000
+        self.mode = 1
+        self.transport = None
+
+    def connection_made(self, transport):
+        """Keep the transport used to answer."""
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        """Answer a request after the simulated latency."""
+        self.packets += 1
+        if self.offline or random.random() < self.loss:
+            return
+        try:
+            _, mac, password, action, action_type = utils.decrypt(data).split('%')
+        except ValueError:
+            _LOGGER.error('Malformed request to %s', self.ip)
+            return
+
+        response = self.handle(action, action_type)
+        if response is None:
+            return
+        payload, response_type = response
+        message = 'lan_device%%%s%%%s%%%s%%%s' % (self.mac, self.password, payload, response_type)
+        asyncio.get_event_loop().call_later(
+            self.latency, self.transport.sendto, utils.encrypt(message), addr)
+
+    def status(self):
+        """Return the status string sent in heartbeat answers."""
+        status = '%s#hv2.0' % self.relay[0]
+        if self.model == 'k2':
+            status += '#ir_module#on#rf_module#on'
+        return status
+
+    def handle(self, action, action_type):
+        """Return the payload and type of the answer to a request."""
+        if action_type == 'heart':
+            return self.status(), 'hack'
+        if action_type == 'usb':
+            return self._handle_toggle(self.usb, action), 'uack'
+        if action_type == 'light':
+            self.light = self._handle_toggle([self.light], action)
+            return self.light, 'lack'
+        if action_type == 'power':
+            return 'power#%s#%.1f' % (self.mac, random.uniform(0, 2000)), 'pack'
+        if action_type == 'uart':
+            return action + ('#ok' if action.startswith('check#') else ''), 'uack'
+        if action_type == 'klight':
+            return self._handle_klight(action), 'klack'
+        if action_type == 'kbulb':
+            return self._handle_kbulb(action), 'kback'
+        return self._handle_toggle(self.relay, action), 'rack'
+
+    @staticmethod
+    def _handle_toggle(states, action):
+        """Handle check, open[N], close[N], openall and closeall."""
+        if action in ('openall', 'closeall'):
+            states[:] = [action[:-3]] * len(states)
+        elif action.startswith(('open', 'close')):
+            state = 'open' if action.startswith('open') else 'close'
+            index = action[len(state):]
+            if index:
+                states[int(index) - 1] = state
+            else:
+                states[:] = [state] * len(states)
+            return state
+        if len(states) == 1:
+            return states[0]
+        return ','.join('%s%s' % (state, index + 1) for index, state in enumerate(states))
+
+    def _handle_klight(self, action):
+        """Handle the requests of a KLight."""
+        if action.startswith('set#'):
+            _, r, g, b, w, _, _ = action.split('#')
+            self.color = [int(r), int(g), int(b)]
+            self.brightness = int(w)
+            return action
+        if action != 'check':
+            return self._handle_toggle(self.relay, action)
+        r, g, b = self.color
+        return '%s#0#0#0#0#1,0#1&#%s#%s#%s#%s#%s,0#1' % (
+            self.relay[0], r, g, b, self.brightness, self.mode)
+
+    def _handle_kbulb(self, action):
+        """Handle the requests of a KBulb."""
+        if action.startswith('set#'):
+            _, key, value = action.split('#')
+            if key == 'lum':
+                self.brightness = int(value)
+            elif key == 'ctp':
+                self.ct = int(value)
+            elif key == 'mode':
+                self.mode = int(value)
+            return action
+        if action != 'check':
+            return self._handle_toggle(self.relay, action)
+        return '%s#%s,%s,%s' % (self.relay[0], self.ct, self.brightness, self.mode)
+
+
+class SimulatedFleet(object):
+    """A fleet of simulated devices on 127.0.1.x addresses."""
+
+    def __init__(self, count, models=MODELS, **kwargs):
+        """Initialize the fleet, cycling through models."""
+        self.devices = [
+            SimulatedDevice('127.0.%s.%s' % (1 + index // 250, 1 + index % 250),
+                            models[index % len(models)], **kwargs)
+            for index in range(count)]
+
+    @property
+    def packets(self):
+        """Return the number of requests received by the fleet."""
+        return sum(device.packets for device in self.devices)
+
+    async def async_start(self, loop):
+        """Start listening on the address of every device."""
+        for device in self.devices:
+            await loop.create_datagram_endpoint(
+                lambda device=device: device, local_addr=(device.ip, PORT))
+
+    def stop(self):
+        """Stop every device."""
+        for device in self.devices:
+            if device.transport is not None:
+                device.transport.close()
@@ -0,0 +1,387 @@
+"""
+Support for Konke devices.
+
+Shared state for the Konke switch, light and remote platforms.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+from functools import partial
+
+import voluptuous as vol
+
+from homeassistant.const import (
+    ATTR_ENTITY_ID, ATTR_NAME, CONF_HOST, CONF_SCAN_INTERVAL, CONF_TIMEOUT,
+    EVENT_HOMEASSISTANT_STOP)
+from homeassistant.core import callback
+import homeassistant.helpers.config_validation as cv
+
+REQUIREMENTS = ['pykonkeio>=2.1.8']
+
+_LOGGER = logging.getLogger(__name__)
+
+DOMAIN = 'konke'
+DATA_KONKE = 'konke'
+DATA_SCAN_INTERVAL = 'konke_scan_interval'
+DATA_PUSH_SCAN_INTERVAL = 'konke_push_scan_interval'
+DATA_ENTITIES = 'konke_entities'
+DATA_INVENTORY = 'konke_inventory'
+DATA_PROBE_SEMAPHORE = 'konke_probe_semaphore'
+DATA_CODES = 'konke_codes'
+DATA_TRANSPORT = 'konke_transport'
+DATA_STARTUP = 'konke_startup'
+DATA_HISTORY = 'konke_history'
+DATA_SCENES = 'konke_scenes'
+
+CONF_PUSH = 'push'
+CONF_HEARTBEAT_INTERVAL = 'heartbeat_interval'
+CONF_MAX_IN_FLIGHT = 'max_in_flight'
+CONF_HISTORY = 'history'
+CONF_MAX_SIZE = 'max_size'
+CONF_FILES = 'files'
+
+DEFAULT_SCAN_INTERVAL = timedelta(seconds=30)
+DEFAULT_FALLBACK_SCAN_INTERVAL = timedelta(minutes=5)
+DEFAULT_HEARTBEAT_INTERVAL = timedelta(seconds=2)
+DEFAULT_MAX_IN_FLIGHT = 32
+# Models whose whole state is carried by the heartbeat status.
+HEARTBEAT_MODELS = ('smart plugin', 'k1', 'minik', 'minik pro')
+DEFAULT_PARALLEL = 10
+PROBE_PARALLEL = 8
+PROBE_TIMEOUT = 15
+DEFAULT_GROUP_TIMEOUT = 10
+DEFAULT_HISTORY_MAX_SIZE = 1048576
+DEFAULT_HISTORY_FILES = 3
+HISTORY_PATH = 'konke_history'
+DEFAULT_SCENE = 'default'
+
+SERVICE_GROUP_TURN_ON = 'group_turn_on'
+SERVICE_GROUP_TURN_OFF = 'group_turn_off'
+SERVICE_DUMP_METRICS = 'dump_metrics'
+SERVICE_EXPORT_HISTORY = 'export_history'
+SERVICE_SNAPSHOT_SCENE = 'snapshot_scene'
+SERVICE_RESTORE_SCENE = 'restore_scene'
+EVENT_GROUP_RESULT = 'konke_group_result'
+ATTR_PARALLEL = 'parallel'
+ATTR_SERVICE = 'service'
+ATTR_SUCCEEDED = 'succeeded'
+ATTR_FAILED = 'failed'
+ATTR_FILENAME = 'filename'
+ATTR_START = 'start'
+ATTR_END = 'end'
+
+DEFAULT_METRICS_FILENAME = 'konke_metrics.prom'
+
+DOMAIN_SCHEMA = vol.Schema({
+    vol.Optional(CONF_PUSH, default=True): cv.boolean,
+    vol.Optional(CONF_HEARTBEAT_INTERVAL, default=DEFAULT_HEARTBEAT_INTERVAL): cv.time_period,
+    vol.Optional(CONF_SCAN_INTERVAL): cv.time_period,
+    vol.Optional(CONF_MAX_IN_FLIGHT, default=DEFAULT_MAX_IN_FLIGHT): vol.All(int, vol.Range(min=1)),
+    vol.Optional(CONF_HISTORY): vol.Schema({
+        vol.Optional(CONF_MAX_SIZE, default=DEFAULT_HISTORY_MAX_SIZE): vol.All(int, vol.Range(min=1024)),
+        vol.Optional(CONF_FILES, default=DEFAULT_HISTORY_FILES): vol.All(int, vol.Range(min=1)),
+    }),
+})
+
+CONFIG_SCHEMA = vol.Schema({
+    DOMAIN: DOMAIN_SCHEMA,
+}, extra=vol.ALLOW_EXTRA)
+
+GROUP_SCHEMA = vol.Schema({
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional(ATTR_PARALLEL, default=DEFAULT_PARALLEL): vol.All(int, vol.Range(min=1)),
+    vol.Optional(CONF_TIMEOUT, default=DEFAULT_GROUP_TIMEOUT): vol.All(vol.Coerce(float), vol.Range(min=0)),
+})
+
+DUMP_METRICS_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_FILENAME, default=DEFAULT_METRICS_FILENAME): cv.string,
+})
+
+SNAPSHOT_SCENE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_NAME, default=DEFAULT_SCENE): cv.string,
+})
+
+RESTORE_SCENE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_NAME, default=DEFAULT_SCENE): cv.string,
+    vol.Optional(ATTR_PARALLEL, default=DEFAULT_PARALLEL): vol.All(int, vol.Range(min=1)),
+    vol.Optional(CONF_TIMEOUT, default=DEFAULT_GROUP_TIMEOUT): vol.All(vol.Coerce(float), vol.Range(min=0)),
+})
+
+EXPORT_HISTORY_SCHEMA = vol.Schema({
+    vol.Required(CONF_HOST): cv.string,
+    vol.Optional(ATTR_START): cv.datetime,
+    vol.Optional(ATTR_END): cv.datetime,
+    vol.Optional(ATTR_FILENAME): cv.string,
+})
+
+
+async def async_setup(hass, config):
+    """Set up the Konke component."""
+    from . import library
+    from .codes import KonkeCodeLibrary
+    from .discovery import KonkeInventory
+    from .history import KonkeHistory
+    from .scenes import KonkeScenes
+    from .listener import KonkeListener
+    from .transport import KonkeTransport
+
+    start = time.monotonic()
+    startup = hass.data[DATA_STARTUP] = {'start': start}
+    await library.async_load(hass)
+    startup['import'] = library.import_time
+
+    conf = config.get(DOMAIN) or DOMAIN_SCHEMA({})
+    coordinators = hass.data.setdefault(DATA_KONKE, {})
+    hass.data.setdefault(DATA_ENTITIES, {})
+
+    transport = hass.data[DATA_TRANSPORT] = KonkeTransport(hass, conf[CONF_MAX_IN_FLIGHT])
+    transport.async_start()
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, transport.async_stop)
+
+    if CONF_HISTORY in conf:
+        history = hass.data[DATA_HISTORY] = KonkeHistory(
+            hass, hass.config.path(HISTORY_PATH),
+            conf[CONF_HISTORY][CONF_MAX_SIZE], conf[CONF_HISTORY][CONF_FILES])
+        history.async_start()
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, history.async_stop)
+
+    inventory = hass.data[DATA_INVENTORY] = KonkeInventory(hass)
+    await inventory.async_load()
+    if not inventory:
+        hass.async_add_job(inventory.async_probe())
+
+    codes = hass.data[DATA_CODES] = KonkeCodeLibrary(hass)
+    await codes.async_load()
+
+    scenes = hass.data[DATA_SCENES] = KonkeScenes(hass)
+    await scenes.async_load()
+
+    if conf[CONF_PUSH]:
+        hass.data[DATA_SCAN_INTERVAL] = DEFAULT_SCAN_INTERVAL
+        hass.data[DATA_PUSH_SCAN_INTERVAL] = conf.get(
+            CONF_SCAN_INTERVAL, DEFAULT_FALLBACK_SCAN_INTERVAL)
+        listener = KonkeListener(hass, coordinators, inventory, conf[CONF_HEARTBEAT_INTERVAL])
+        listener.async_start()
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, listener.async_stop)
+    else:
+        hass.data[DATA_SCAN_INTERVAL] = conf.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
+
+    async def async_group_service_handler(service):
+        """Turn many Konke lights and switches on or off concurrently."""
+        from .helpers import async_gather_bounded
+
+        entities = hass.data[DATA_ENTITIES]
+        jobs = {}
+        missing = []
+        for entity_id in service.data[ATTR_ENTITY_ID]:
+            entity = entities.get(entity_id)
+            if entity is None:
+                _LOGGER.error("Entity_id: '%s' not found", entity_id)
+                missing.append(entity_id)
+            elif service.service == SERVICE_GROUP_TURN_ON:
+                jobs[entity_id] = entity.async_turn_on
+            else:
+                jobs[entity_id] = entity.async_turn_off
+
+        failed = await async_gather_bounded(
+            jobs, service.data[ATTR_PARALLEL], service.data[CONF_TIMEOUT])
+        for entity_id, err in failed.items():
+            _LOGGER.warning('Failed to %s %s: %r', service.service, entity_id, err)
+
+        hass.bus.async_fire(EVENT_GROUP_RESULT, {
+            ATTR_SERVICE: service.service,
+            ATTR_SUCCEEDED: [entity_id for entity_id in jobs if entity_id not in failed],
+            ATTR_FAILED: missing + list(failed),
+        })
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_GROUP_TURN_ON, async_group_service_handler, schema=GROUP_SCHEMA)
+    hass.services.async_register(
+        DOMAIN, SERVICE_GROUP_TURN_OFF, async_group_service_handler, schema=GROUP_SCHEMA)
+
+    async def async_dump_metrics_service_handler(service):
+        """Write the device statistics in the Prometheus text format."""
+        from .stats import prometheus_text
+
+        path = get_output_path(hass, service.data[ATTR_FILENAME])
+        if path is None:
+            return
+        text = prometheus_text(
+            [coordinator.stats for coordinator in coordinators.values()], startup)
+
+        def write_metrics():
+            with open(path, 'w') as file:
+                file.write(text)
+
+        await hass.async_add_job(write_metrics)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_DUMP_METRICS, async_dump_metrics_service_handler,
+        schema=DUMP_METRICS_SCHEMA)
+
+    async def async_export_history_service_handler(service):
+        """Write the recorded history of a device in a time range as CSV."""
+        history = hass.data.get(DATA_HISTORY)
+        if history is None:
+            _LOGGER.error('History is not enabled, add history to the konke configuration')
+            return
+
+        host = service.data[CONF_HOST]
+        if host not in coordinators:
+            _LOGGER.error("Device '%s' is not set up", host)
+            return
+        filename = service.data.get(ATTR_FILENAME) or 'konke_history_%s.csv' % host
+        path = get_output_path(hass, filename)
+        if path is None:
+            return
+
+        start = service.data.get(ATTR_START)
+        end = service.data.get(ATTR_END)
+        count = await history.async_export(
+            host, path,
+            None if start is None else start.timestamp(),
+            None if end is None else end.timestamp())
+        _LOGGER.debug('Exported %s history records of %s', count, host)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_EXPORT_HISTORY, async_export_history_service_handler,
+        schema=EXPORT_HISTORY_SCHEMA)
+
+    @callback
+    def async_snapshot_scene_service_handler(service):
+        """Capture the state of every Konke device."""
+        scenes.async_snapshot(service.data[ATTR_NAME], coordinators)
+
+    async def async_restore_scene_service_handler(service):
+        """Move every Konke device of a scene back to its captured state."""
+        from .helpers import async_gather_bounded
+        from .scenes import async_restore, diff
+
+        name = service.data[ATTR_NAME]
+        scene = scenes.get(name)
+        if scene is None:
+            _LOGGER.error("Scene '%s' not found", name)
+            return
+
+        jobs = {}
+        for host, target in scene.items():
+            coordinator = coordinators.get(host)
+            if coordinator is None:
+                _LOGGER.warning("Device '%s' of scene '%s' is not set up", host, name)
+            elif diff(coordinator.device, target):
+                jobs[host] = partial(
+                    coordinator.async_command, None,
+                    partial(async_restore, coordinator.device, target))
+
+        failed = await async_gather_bounded(
+            jobs, service.data[ATTR_PARALLEL], service.data[CONF_TIMEOUT])
+        for host, err in failed.items():
+            _LOGGER.warning('Failed to restore %s: %r', host, err)
+
+        hass.bus.async_fire(EVENT_GROUP_RESULT, {
+            ATTR_SERVICE: service.service,
+            ATTR_SUCCEEDED: [host for host in jobs if host not in failed],
+            ATTR_FAILED: list(failed),
+        })
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_SNAPSHOT_SCENE, async_snapshot_scene_service_handler,
+        schema=SNAPSHOT_SCENE_SCHEMA)
+    hass.services.async_register(
+        DOMAIN, SERVICE_RESTORE_SCENE, async_restore_scene_service_handler,
+        schema=RESTORE_SCENE_SCHEMA)
+
+    startup['setup'] = time.monotonic() - start
+    _LOGGER.debug('Konke setup took %.3fs, %.3fs of it importing pykonkeio',
+                  startup['setup'], startup['import'])
+    return True
+
+
+@callback
+def async_register_entity(hass, entity):
+    """Make an entity reachable by the integration level services."""
+    hass.data.setdefault(DATA_ENTITIES, {})[entity.entity_id] = entity
+
+
+@callback
+def async_unregister_entity(hass, entity):
+    """Forget an entity registered with async_register_entity."""
+    hass.data.get(DATA_ENTITIES, {}).pop(entity.entity_id, None)
+
+
+def get_coordinator(hass, host, model):
+    """Return the coordinator of the device at host, creating it if needed."""
+    from . import library
+    from .coordinator import KonkeCoordinator
+
+    coordinators = hass.data.setdefault(DATA_KONKE, {})
+    if host not in coordinators:
+        scan_interval = hass.data.get(DATA_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
+        if model in HEARTBEAT_MODELS:
+            scan_interval = hass.data.get(DATA_PUSH_SCAN_INTERVAL, scan_interval)
+        transport = hass.data.get(DATA_TRANSPORT)
+        coordinator = KonkeCoordinator(
+            hass, library.manager.get_device(host, model), scan_interval,
+            transport.semaphore if transport is not None else None)
+        coordinator.history = hass.data.get(DATA_HISTORY)
+        coordinators[host] = coordinator
+        semaphore = hass.data.get(DATA_PROBE_SEMAPHORE)
+        if semaphore is None:
+            semaphore = hass.data[DATA_PROBE_SEMAPHORE] = asyncio.Semaphore(PROBE_PARALLEL)
+        coordinator.probe = hass.loop.create_task(coordinator.async_probe(semaphore))
+        _LOGGER.debug("Init coordinator %s %s", model, host)
+
+        inventory = hass.data.get(DATA_INVENTORY)
+        if inventory is not None:
+            inventory.async_set_model(host, model, coordinator.device)
+    return coordinators[host]
+
+
+async def async_add_entities_when_probed(coordinator, async_add_entities, entities,
+                                         platform=None):
+    """Add entities once their device answered its first refresh.
+
+    Devices that do not answer within PROBE_TIMEOUT, or whose probe
+    failed, are added as unavailable, so that they do not hold up the
+    startup. The time from the Konke setup to the first state of the
+    platform is recorded.
+    """
+    try:
+        await asyncio.wait_for(asyncio.shield(coordinator.probe), PROBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        _LOGGER.warning('Device %s is slow to answer, adding it as unavailable',
+                        coordinator.device.ip)
+    except Exception:  # pylint: disable=broad-except
+        _LOGGER.exception('Failed to probe %s, adding it as unavailable',
+                          coordinator.device.ip)
+    async_add_entities(entities)
+
+    startup = coordinator.hass.data.get(DATA_STARTUP)
+    if platform is not None and startup is not None:
+        elapsed = time.monotonic() - startup['start']
+        if elapsed > startup.get(platform, 0):
+            startup[platform] = elapsed
+            _LOGGER.debug('Konke %s platform first state after %.3fs', platform, elapsed)
+
+
+def get_output_path(hass, filename):
+    """Return the path of a file written by a service, or None if not allowed.
+
+    Only plain file names are accepted, and the configuration directory
+    must be an allowed path (whitelist_external_dirs).
+    """
+    path = hass.config.path(filename)
+    if os.path.basename(filename) != filename or filename in ('', '.', '..') or \
+            not hass.config.is_allowed_path(path):
+        _LOGGER.error("Refusing to write '%s', use a file name in an allowed "
+                      "configuration directory", filename)
+        return None
+    return path
+
+
+def get_inventory_info(hass, host):
+    """Return what discovery knows about the device at host, or None."""
+    inventory = hass.data.get(DATA_INVENTORY)
+    return None if inventory is None else inventory.get(host)
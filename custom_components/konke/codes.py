@@ -0,0 +1,77 @@
+"""
+Library of named IR/RF codes for Konke remotes.
+
+A name is given one slot per remote type, shared by every remote, so the
+same name can be learned on and sent to any number of devices. The
+library is kept in memory as a dict per remote type and persisted.
+Slots from NAMED_SLOT_MIN on are reserved for named codes. A new name is
+only persisted once a code was learned into its slot.
+"""
+import logging
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY = 'konke.codes'
+STORAGE_VERSION = 1
+
+NAMED_SLOT_MIN = 900000
+NAMED_SLOT_MAX = 999999
+
+
+class KonkeCodeLibrary(object):
+    """Persistent mapping of code names to remote slots."""
+
+    def __init__(self, hass):
+        """Initialize the code library."""
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._codes = {}
+        self._pending = {}
+
+    async def async_load(self):
+        """Load the library saved by a previous run."""
+        self._codes = await self._store.async_load() or {}
+
+    def get(self, remote_type, name):
+        """Return the slot of a named code, or None."""
+        return self._codes.get(remote_type, {}).get(name)
+
+    @callback
+    def async_allocate(self, remote_type, name):
+        """Return the slot of a named code, reserving a free one if needed.
+
+        A reserved slot is only saved by async_commit, once learned.
+        """
+        codes = self._codes.setdefault(remote_type, {})
+        pending = self._pending.setdefault(remote_type, {})
+        if name in codes:
+            return codes[name]
+        if name in pending:
+            return pending[name]
+
+        used = set(codes.values()) | set(pending.values())
+        slot = max(used, default=NAMED_SLOT_MIN - 1) + 1
+        if slot > NAMED_SLOT_MAX:
+            slot = next((slot for slot in range(NAMED_SLOT_MIN, NAMED_SLOT_MAX + 1)
+                         if slot not in used), None)
+            if slot is None:
+                raise ValueError('No free slot left for %s' % name)
+
+        pending[name] = slot
+        _LOGGER.debug('Reserved %s slot %s for %s', remote_type, slot, name)
+        return slot
+
+    @callback
+    def async_commit(self, remote_type, name):
+        """Save the slot reserved for a name whose code was learned."""
+        slot = self._pending.get(remote_type, {}).pop(name, None)
+        if slot is not None:
+            self._codes.setdefault(remote_type, {})[name] = slot
+            self._store.async_delay_save(lambda: self._codes)
+
+    @callback
+    def async_release(self, remote_type, name):
+        """Drop the slot reserved for a name whose code was not learned."""
+        self._pending.get(remote_type, {}).pop(name, None)
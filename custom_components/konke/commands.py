@@ -0,0 +1,109 @@
+"""
+Per-device command queue for Konke devices.
+
+All I/O with one device goes through its queue, one request at a time.
+Commands are sent before polls. A queued command is replaced by a newer
+command with the same key, so only the last of many queued toggles is
+sent, and a queued background poll is dropped when a command arrives
+because the command is followed by a refresh anyway. Queues may share a
+semaphore bounding the requests in flight across devices.
+"""
+import logging
+from collections import OrderedDict
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class KonkeCommandQueue(object):
+    """Serialise the requests sent to one device."""
+
+    def __init__(self, loop, semaphore=None):
+        """Initialize the command queue."""
+        self._loop = loop
+        self._semaphore = semaphore
+        self._commands = OrderedDict()
+        self._polls = OrderedDict()
+        self._worker = None
+
+    async def async_command(self, key, factory):
+        """Queue a command and wait until it, or the one replacing it, is sent.
+
+        factory is a callable returning the coroutine to run. Commands with
+        the same key replace each other while queued; a key of None is
+        never replaced.
+        """
+        if key is None:
+            key = object()
+        future = self._loop.create_future()
+        entry = self._commands.get(key)
+        if entry is None:
+            self._commands[key] = [factory, [future]]
+        else:
+            _LOGGER.debug('Command %s superseded', key)
+            entry[0] = factory
+            entry[1].append(future)
+
+        for poll_key, (_, futures, droppable) in list(self._polls.items()):
+            if droppable:
+                del self._polls[poll_key]
+                self._resolve(futures, False)
+
+        self._ensure_worker()
+        return await future
+
+    async def async_poll(self, factory, droppable=False, key=None):
+        """Queue a poll behind the commands and wait until it is sent.
+
+        Return False if a droppable poll was dropped for a command, True
+        once the poll was sent. Concurrent polls with the same key are sent
+        once.
+        """
+        if droppable and self._commands:
+            return False
+
+        future = self._loop.create_future()
+        entry = self._polls.get(key)
+        if entry is None:
+            self._polls[key] = [factory, [future], droppable]
+        else:
+            entry[1].append(future)
+            entry[2] = entry[2] and droppable
+
+        self._ensure_worker()
+        return await future
+
+    def _ensure_worker(self):
+        """Start sending queued requests."""
+        if self._worker is None:
+            self._worker = self._loop.create_task(self._async_work())
+
+    async def _async_work(self):
+        """Send queued requests one at a time, commands first."""
+        try:
+            while self._commands or self._polls:
+                if self._commands:
+                    _, (factory, futures) = self._commands.popitem(last=False)
+                else:
+                    _, (factory, futures, _) = self._polls.popitem(last=False)
+
+                try:
+                    if self._semaphore is None:
+                        await factory()
+                    else:
+                        async with self._semaphore:
+                            await factory()
+                except Exception as err:  # pylint: disable=broad-except
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(err)
+                else:
+                    self._resolve(futures, True)
+        finally:
+            self._worker = None
+
+    @staticmethod
+    def _resolve(futures, result):
+        """Set the result of waiting futures."""
+        for future in futures:
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,281 @@
+"""
+Shared device coordinator for Konke devices.
+
+One coordinator exists per host. It owns the pykonkeio device handle,
+refreshes the full device state once per scan interval and notifies
+every entity subscribed to it. With push enabled the scan interval is
+only a slow fallback for missed heartbeats.
+
+All requests to the device go through its command queue. Commands show
+their acknowledged state right away and are confirmed, or
+rolled back, by a single refresh shortly after the last command.
+
+Polls are scheduled per device: offline devices back off exponentially,
+devices whose state changed recently are polled faster, and every delay
+is jittered so that many devices do not poll in the same tick.
+
+A circuit breaker fed by the DeviceOffline errors of polls and commands
+makes commands fail fast while the device is unreachable. The scheduled
+polls, which back off with the failures, are its half-open probes.
+
+Entities subscribe to the fields they show. After each refresh or command
+the coordinator compares a compact snapshot of the device state with the
+last one notified and only notifies entities whose fields changed, so
+commands collapsed into one send notify once. Fields are attribute
+names; the items of list attributes are also (name, index).
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import timedelta
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+
+from . import library
+from .commands import KonkeCommandQueue
+from .helpers import CircuitBreaker, SingleFlight
+from .stats import instrument_device
+
+_LOGGER = logging.getLogger(__name__)
+
+FAST_SCAN_INTERVAL = timedelta(seconds=10)
+RECENT_CHANGE_WINDOW = timedelta(minutes=1)
+MAX_BACKOFF_INTERVAL = timedelta(minutes=30)
+SCAN_JITTER = 0.1
+CONFIRM_DELAY = 1.0
+BREAKER_THRESHOLD = 2
+
+SNAPSHOT_ATTRIBUTES = ('status', 'usb_status', 'light_status', 'brightness', 'color', 'ct')
+MODULE_ATTRIBUTES = ('is_support_ir', 'is_support_rf')
+FIELD_AVAILABLE = 'available'
+FIELD_CIRCUIT = 'circuit'
+SNAPSHOT_FIELDS = (FIELD_AVAILABLE, FIELD_CIRCUIT) + SNAPSHOT_ATTRIBUTES + MODULE_ATTRIBUTES
+
+
+class KonkeCoordinator(object):
+    """Refresh a Konke device and push its state to entities."""
+
+    def __init__(self, hass, device, scan_interval, semaphore=None):
+        """Initialize the coordinator."""
+        self.hass = hass
+        self.device = device
+        self.scan_interval = scan_interval
+        self.probe = None
+        self.learn_lock = asyncio.Lock()
+        self.queue = KonkeCommandQueue(hass.loop, semaphore)
+        self.stats = instrument_device(device)
+        self._listeners = []
+        self._unsub_refresh = None
+        self._unsub_confirm = None
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD)
+        self.history = None
+        self._last_changed = None
+        self._refresh = SingleFlight()
+        self._meter = None
+        self._last_snapshot = self._snapshot()
+
+    @property
+    def available(self) -> bool:
+        """Return True if device is available."""
+        return self.device.is_online
+
+    @property
+    def unique_id(self):
+        """Return unique ID for device."""
+        return self.device.uuid
+
+    @callback
+    def async_add_listener(self, update_callback, fields=None):
+        """Subscribe an entity callback to changes of fields.
+
+        Without fields the callback is notified of every change; the
+        availability and circuit of the device are always part of the fields.
+        """
+        if fields is not None:
+            fields = frozenset(fields) | {FIELD_AVAILABLE, FIELD_CIRCUIT}
+        self._listeners.append((update_callback, fields))
+        self._async_schedule_refresh(
+            random.uniform(0, self.scan_interval.total_seconds()))
+
+    @callback
+    def async_remove_listener(self, update_callback):
+        """Unsubscribe an entity callback from device updates."""
+        self._listeners = [
+            listener for listener in self._listeners if listener[0] != update_callback]
+        if not self._listeners and self._unsub_refresh is not None:
+            self._unsub_refresh()
+            self._unsub_refresh = None
+
+    @callback
+    def async_update_listeners(self, changed=None):
+        """Notify the entities subscribed to a changed field, all without changed."""
+        for update_callback, fields in list(self._listeners):
+            if changed is None or fields is None or not fields.isdisjoint(changed):
+                update_callback()
+
+    async def async_command(self, key, factory):
+        """Queue a command and push its acknowledged state optimistically.
+
+        factory returns the coroutine sending the command; a queued command
+        is replaced by a newer one with the same key.
+        """
+        self._check_circuit()
+        try:
+            await self.async_send(key, factory)
+        finally:
+            self._async_changed()
+            self._async_schedule_confirm()
+
+    async def async_send(self, key, factory):
+        """Queue a request, failing fast while the circuit breaker is open."""
+        self._check_circuit()
+        try:
+            await self.queue.async_command(key, factory)
+        except library.error.DeviceOffline:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+    def _check_circuit(self):
+        """Raise DeviceOffline while the circuit breaker refuses requests."""
+        if not self.breaker.allow():
+            raise library.error.DeviceOffline('circuit breaker is %s' % self.breaker.state)
+
+    @callback
+    def _async_schedule_confirm(self):
+        """Confirm the device state once commands settle."""
+        if self._unsub_confirm is not None:
+            self._unsub_confirm()
+        self._unsub_confirm = async_call_later(
+            self.hass, CONFIRM_DELAY, self._async_confirm)
+
+    async def _async_confirm(self, now):
+        """Refresh the device to confirm or roll back the commanded state."""
+        self._unsub_confirm = None
+        await self.async_refresh()
+
+    def next_refresh_delay(self) -> float:
+        """Return the seconds to wait before the next scheduled poll."""
+        delay = self.scan_interval.total_seconds()
+        failures = self.breaker.failures
+        if failures:
+            delay = min(delay * 2 ** min(failures, 16),
+                        max(delay, MAX_BACKOFF_INTERVAL.total_seconds()))
+        elif self._last_changed is not None and \
+                time.monotonic() - self._last_changed < RECENT_CHANGE_WINDOW.total_seconds():
+            delay = min(delay, FAST_SCAN_INTERVAL.total_seconds())
+        return delay * random.uniform(1 - SCAN_JITTER, 1 + SCAN_JITTER)
+
+    @callback
+    def _async_schedule_refresh(self, delay):
+        """Schedule the next poll unless one is already scheduled."""
+        if self._unsub_refresh is None:
+            self._unsub_refresh = async_call_later(
+                self.hass, delay, self._async_refresh_interval)
+
+    async def _async_refresh_interval(self, now):
+        """Refresh the device and schedule the next poll."""
+        self._unsub_refresh = None
+        try:
+            await self.async_refresh(droppable=True)
+        finally:
+            if self._listeners:
+                self._async_schedule_refresh(self.next_refresh_delay())
+
+    def _snapshot(self):
+        """Return the state of the device used to detect changes."""
+        device = self.device
+        return (device.is_online, self.breaker.state) + tuple(
+            tuple(value) if isinstance(value, list) else value
+            for value in (getattr(device, name, None)
+                          for name in SNAPSHOT_ATTRIBUTES + MODULE_ATTRIBUTES))
+
+    @callback
+    def _async_changed(self):
+        """Record and notify the fields changed since the last notification, and return them."""
+        snapshot = self._snapshot()
+        changed = changed_fields(self._last_snapshot, snapshot)
+        if not changed:
+            return changed
+        self._last_snapshot = snapshot
+        if self.history is not None:
+            for field, value in zip(SNAPSHOT_FIELDS, snapshot):
+                if field in changed:
+                    self.history.async_record_field(self.device.ip, field, value)
+        self.async_update_listeners(changed)
+        return changed
+
+    async def async_probe(self, semaphore):
+        """Run the first refresh, at most as many at once as semaphore allows."""
+        async with semaphore:
+            try:
+                await self.async_refresh()
+            except library.error.KonkeError as err:
+                _LOGGER.warning('Failed to probe %s: %s', self.device.ip, err)
+
+    async def async_refresh(self, droppable=False):
+        """Synchronize the full state of the device and notify entities.
+
+        Concurrent callers share the refresh already in flight. A droppable
+        refresh is skipped when a command is queued, as the command is
+        confirmed by a refresh of its own, so a refresh that is not
+        droppable waits for a droppable one in flight and then polls itself.
+        """
+        while not droppable and self._refresh.args == (True,):
+            await self._refresh.async_call(self._async_do_refresh, True)
+        await self._refresh.async_call(self._async_do_refresh, droppable)
+
+    async def _async_do_refresh(self, droppable):
+        """Query the device once."""
+        prev_available = self.available
+        try:
+            if not await self.queue.async_poll(self._async_poll, droppable):
+                return
+            self.breaker.record_success()
+        except library.error.DeviceOffline:
+            self.breaker.record_failure()
+            if prev_available:
+                _LOGGER.warning('Device is offline %s', self.device.ip)
+        except library.error.KonkeError as err:
+            self.breaker.record_failure()
+            _LOGGER.warning('Failed to refresh %s: %s', self.device.ip, err)
+        except Exception:  # pylint: disable=broad-except
+            self.breaker.record_failure()
+            _LOGGER.exception('Unexpected error refreshing %s', self.device.ip)
+
+        if self._async_changed() - {FIELD_AVAILABLE, FIELD_CIRCUIT}:
+            self._last_changed = time.monotonic()
+
+    async def _async_poll(self):
+        """Read the full state of the device."""
+        self.breaker.begin_probe()
+        await self.device.update()
+
+    def get_power_meter(self, sample_interval=None):
+        """Return the power meter of the device, creating it if needed."""
+        from .metering import KonkePowerMeter
+        if self._meter is None:
+            self._meter = KonkePowerMeter(self)
+        if sample_interval is not None:
+            self._meter.sample_interval = sample_interval
+        return self._meter
+
+
+def changed_fields(prev, snapshot):
+    """Return the fields that differ between two snapshots."""
+    changed = set()
+    if prev == snapshot:
+        return changed
+    for field, old, new in zip(SNAPSHOT_FIELDS, prev, snapshot):
+        if old == new:
+            continue
+        changed.add(field)
+        if isinstance(old, tuple) or isinstance(new, tuple):
+            old = old if isinstance(old, tuple) else ()
+            new = new if isinstance(new, tuple) else ()
+            changed.update(
+                (field, index) for index in range(max(len(old), len(new)))
+                if old[index:index + 1] != new[index:index + 1])
+    return changed
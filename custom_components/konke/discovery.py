@@ -0,0 +1,102 @@
+"""
+Discovery of Konke devices on the LAN.
+
+The inventory maps the MAC of every Konke device seen on the LAN to its
+IP address, capabilities and configured model. It is persisted so that a
+restart does not need to probe again. Heartbeat answers keep it up to
+date, and it is only saved again when a device is new or its IP changed.
+"""
+import logging
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+
+from . import library
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY = 'konke.inventory'
+STORAGE_VERSION = 1
+SAVE_DELAY = 10
+
+ATTR_IP = 'ip'
+ATTR_MODEL = 'model'
+ATTR_IR = 'ir'
+ATTR_RF = 'rf'
+ATTR_SOCKET_COUNT = 'socket_count'
+ATTR_USB_COUNT = 'usb_count'
+
+
+class KonkeInventory(object):
+    """Persistent inventory of the Konke devices on the LAN."""
+
+    def __init__(self, hass):
+        """Initialize the inventory."""
+        self.hass = hass
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._devices = {}
+        self._macs = {}
+
+    def __len__(self):
+        """Return the number of known devices."""
+        return len(self._devices)
+
+    async def async_load(self):
+        """Load the inventory saved by a previous run."""
+        data = await self._store.async_load()
+        if data:
+            self._devices = data
+            self._macs = {info[ATTR_IP]: mac for mac, info in data.items()}
+
+    async def async_probe(self):
+        """Broadcast one probe and record every device that answers."""
+        try:
+            await library.manager.search(callback=self.async_seen)
+        except library.error.Timeout:
+            pass
+        _LOGGER.debug('Probe found %s devices', len(self))
+
+    @callback
+    def async_seen(self, ip, mac, password, status, *_):
+        """Record a device that answered a probe or heartbeat."""
+        info = self._devices.get(mac)
+        if info is not None and info[ATTR_IP] == ip:
+            return
+
+        if info is None:
+            _LOGGER.debug('New device %s %s', mac, ip)
+            info = self._devices[mac] = {}
+        else:
+            _LOGGER.info('Device %s moved from %s to %s', mac, info[ATTR_IP], ip)
+            self._macs.pop(info[ATTR_IP], None)
+
+        info[ATTR_IP] = ip
+        info[ATTR_IR] = '#ir_module#on' in status or '#hv2.' in status
+        info[ATTR_RF] = '#rf_module#on' in status
+        self._macs[ip] = mac
+        self._async_save()
+
+    def get(self, ip):
+        """Return what is known about the device at ip."""
+        mac = self._macs.get(ip)
+        return None if mac is None else self._devices[mac]
+
+    @callback
+    def async_set_model(self, ip, model, device):
+        """Record the model configured for the device at ip."""
+        info = self.get(ip)
+        if info is None or info.get(ATTR_MODEL) == model:
+            return
+
+        if info.get(ATTR_MODEL) is not None:
+            _LOGGER.warning('Device at %s is configured as %s but was %s before',
+                            ip, model, info[ATTR_MODEL])
+        info[ATTR_MODEL] = model
+        info[ATTR_SOCKET_COUNT] = getattr(device, 'socket_count', 0)
+        info[ATTR_USB_COUNT] = getattr(device, 'usb_count', 1 if hasattr(device, 'usb_status') else 0)
+        self._async_save()
+
+    @callback
+    def _async_save(self):
+        """Save the inventory soon."""
+        self._store.async_delay_save(lambda: self._devices, SAVE_DELAY)
@@ -0,0 +1,102 @@
+"""
+Helpers shared by the Konke platforms.
+"""
+import asyncio
+
+ATTR_CIRCUIT = 'circuit'
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class SingleFlight(object):
+    """Share one in-flight coroutine call between concurrent callers.
+
+    While a call is running, further callers await the same future
+    instead of starting another one, and all of them get its result.
+    The arguments of the running call are kept in args, None when idle.
+    """
+
+    def __init__(self):
+        """Initialize the single flight."""
+        self._future = None
+        self.args = None
+
+    async def async_call(self, func, *args):
+        """Run func, or join the call already running."""
+        if self._future is None:
+            future = asyncio.ensure_future(func(*args))
+            future.add_done_callback(self._done)
+            self._future = future
+            self.args = args
+        return await asyncio.shield(self._future)
+
+    def _done(self, future):
+        """Forget the finished call."""
+        if self._future is future:
+            self._future = None
+            self.args = None
+
+
+class CircuitBreaker(object):
+    """Fail fast while a device is known to be unreachable.
+
+    The breaker opens after threshold consecutive failures. While it is
+    open requests are refused; the next probe makes it half-open, and
+    the result of the probe closes it or opens it again.
+    """
+
+    def __init__(self, threshold):
+        """Initialize the circuit breaker."""
+        self.threshold = threshold
+        self.state = STATE_CLOSED
+        self.failures = 0
+
+    def allow(self) -> bool:
+        """Return True if requests may be sent."""
+        return self.state == STATE_CLOSED
+
+    def begin_probe(self):
+        """Let one probe through an open breaker."""
+        if self.state == STATE_OPEN:
+            self.state = STATE_HALF_OPEN
+
+    def record_success(self):
+        """Close the breaker."""
+        self.failures = 0
+        self.state = STATE_CLOSED
+
+    def record_failure(self):
+        """Count a failure, opening the breaker at the threshold."""
+        self.failures += 1
+        if self.state == STATE_HALF_OPEN or self.failures >= self.threshold:
+            self.state = STATE_OPEN
+
+
+async def async_gather_bounded(jobs, limit, timeout):
+    """Run coroutine factories concurrently with bounded parallelism.
+
+    jobs maps a key to a callable returning a coroutine. At most limit
+    coroutines run at once and all of them must finish within timeout
+    seconds. Return a dict mapping the key of every failed job to its
+    error.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def async_run(job):
+        async with semaphore:
+            await job()
+
+    tasks = {asyncio.ensure_future(async_run(job)): key for key, job in jobs.items()}
+    if not tasks:
+        return {}
+
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    failed = {}
+    for task in pending:
+        task.cancel()
+        failed[tasks[task]] = asyncio.TimeoutError()
+    for task in done:
+        if task.exception() is not None:
+            failed[tasks[task]] = task.exception()
+    return failed
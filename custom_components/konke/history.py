@@ -0,0 +1,203 @@
+"""
+Local state history of Konke devices.
+
+Every state transition seen by a coordinator, and every power sample of a
+K2, is appended to a per-host file of fixed-width binary records:
+timestamp (float64), kind (uint8), index (uint8), two padding bytes and
+value (float32). Records are buffered and written in the executor. A file
+is rotated to <host>.bin.1, .2, ... once it reaches the size limit.
+
+Reads memory-map the files and seek to the start of a range by bisecting
+the timestamps, so a range is streamed without loading whole files.
+"""
+import logging
+import mmap
+import os
+import struct
+import time
+from datetime import timedelta
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_time_interval
+
+_LOGGER = logging.getLogger(__name__)
+
+RECORD = struct.Struct('<dBBxxf')
+
+KIND_AVAILABLE = 1
+KIND_STATUS = 2
+KIND_USB = 3
+KIND_LIGHT = 4
+KIND_BRIGHTNESS = 5
+KIND_CT = 6
+KIND_COLOR = 7
+KIND_POWER = 8
+
+FIELD_KINDS = {
+    'available': KIND_AVAILABLE,
+    'status': KIND_STATUS,
+    'usb_status': KIND_USB,
+    'light_status': KIND_LIGHT,
+    'brightness': KIND_BRIGHTNESS,
+    'ct': KIND_CT,
+    'color': KIND_COLOR,
+}
+KIND_NAMES = {kind: field for field, kind in FIELD_KINDS.items()}
+KIND_NAMES[KIND_POWER] = 'power'
+
+FLUSH_INTERVAL = timedelta(seconds=10)
+FILE_SUFFIX = '.bin'
+
+
+def encode_value(value):
+    """Return the float stored for a device value."""
+    if value == 'open' or value is True:
+        return 1.0
+    if value == 'close' or value is False or value is None:
+        return 0.0
+    if isinstance(value, (list, tuple)):
+        red, green, blue = value
+        return float(red << 16 | green << 8 | blue)
+    return float(value)
+
+
+class KonkeHistory(object):
+    """Append-only binary history of Konke devices."""
+
+    def __init__(self, hass, path, max_size, files):
+        """Initialize the history."""
+        self.hass = hass
+        self.path = path
+        self.max_size = max_size - max_size % RECORD.size
+        self.files = files
+        self._buffers = {}
+        self._unsub_flush = None
+
+    @callback
+    def async_start(self):
+        """Flush the buffered records periodically."""
+        self._unsub_flush = async_track_time_interval(
+            self.hass, self.async_flush, FLUSH_INTERVAL)
+
+    async def async_stop(self, event=None):
+        """Stop flushing and write the remaining records."""
+        if self._unsub_flush is not None:
+            self._unsub_flush()
+            self._unsub_flush = None
+        await self.async_flush()
+
+    @callback
+    def async_record(self, host, kind, index, value, timestamp=None):
+        """Buffer one record."""
+        buffer = self._buffers.get(host)
+        if buffer is None:
+            buffer = self._buffers[host] = bytearray()
+        buffer += RECORD.pack(
+            time.time() if timestamp is None else timestamp, kind, index, value)
+
+    @callback
+    def async_record_field(self, host, field, value):
+        """Buffer the records of a changed snapshot field."""
+        kind = FIELD_KINDS.get(field)
+        if kind is None:
+            return
+        timestamp = time.time()
+        if isinstance(value, (list, tuple)) and kind != KIND_COLOR:
+            for index, item in enumerate(value):
+                self.async_record(host, kind, index, encode_value(item), timestamp)
+        else:
+            self.async_record(host, kind, 0, encode_value(value), timestamp)
+
+    async def async_flush(self, now=None):
+        """Append the buffered records to their files."""
+        if not self._buffers:
+            return
+        buffers, self._buffers = self._buffers, {}
+        await self.hass.async_add_job(self._write, buffers)
+
+    def _file(self, host, generation=0):
+        """Return the path of a history file of host."""
+        if os.path.basename(host) != host or host in ('', '.', '..'):
+            raise ValueError('Illegal host %r' % host)
+        path = os.path.join(self.path, host + FILE_SUFFIX)
+        return path if not generation else '%s.%d' % (path, generation)
+
+    def _write(self, buffers):
+        """Append records, rotating files that reach the size limit."""
+        os.makedirs(self.path, exist_ok=True)
+        for host, data in buffers.items():
+            path = self._file(host)
+            while data:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    size = 0
+                if size >= self.max_size:
+                    self._rotate(host)
+                    size = 0
+                chunk = data[:max(self.max_size - size, RECORD.size)]
+                data = data[len(chunk):]
+                with open(path, 'ab') as file:
+                    file.write(chunk)
+
+    def _rotate(self, host):
+        """Shift the history files of host, dropping the oldest one."""
+        for generation in range(self.files - 1, 0, -1):
+            older = self._file(host, generation)
+            if os.path.exists(older):
+                os.replace(older, self._file(host, generation + 1))
+        os.replace(self._file(host), self._file(host, 1))
+        oldest = self._file(host, self.files)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+
+    def query(self, host, start=None, end=None):
+        """Yield the (timestamp, kind, index, value) records of host in a range."""
+        for generation in range(self.files - 1, -1, -1):
+            path = self._file(host, generation)
+            try:
+                file = open(path, 'rb')
+            except OSError:
+                continue
+            with file:
+                size = os.fstat(file.fileno()).st_size
+                count = size // RECORD.size
+                if not count:
+                    continue
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    if start is not None and RECORD.unpack_from(
+                            view, (count - 1) * RECORD.size)[0] < start:
+                        continue
+                    position = 0 if start is None else _bisect(view, count, start)
+                    for offset in range(position * RECORD.size, count * RECORD.size, RECORD.size):
+                        record = RECORD.unpack_from(view, offset)
+                        if end is not None and record[0] > end:
+                            return
+                        yield record
+
+    def export(self, host, path, start=None, end=None):
+        """Write the records of host in a range to a CSV file."""
+        count = 0
+        with open(path, 'w') as file:
+            file.write('timestamp,kind,index,value\n')
+            for timestamp, kind, index, value in self.query(host, start, end):
+                file.write('%.3f,%s,%d,%.10g\n' % (timestamp, KIND_NAMES.get(kind, kind), index, value))
+                count += 1
+        return count
+
+    async def async_export(self, host, path, start=None, end=None):
+        """Flush the buffered records and export a range in the executor."""
+        await self.async_flush()
+        return await self.hass.async_add_job(self.export, host, path, start, end)
+
+
+def _bisect(view, count, timestamp):
+    """Return the index of the first record at or after timestamp."""
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if RECORD.unpack_from(view, middle * RECORD.size)[0] < timestamp:
+            low = middle + 1
+        else:
+            high = middle
+    return low
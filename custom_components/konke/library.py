@@ -0,0 +1,34 @@
+"""
+Cached access to pykonkeio.
+
+Home Assistant installs pykonkeio after it imports this package, so the
+library cannot be imported at module level. The Konke component loads it
+once in the executor during setup; everything else uses the modules
+cached here instead of importing them again on every call.
+"""
+import importlib
+import time
+
+error = None
+manager = None
+socket = None
+import_time = None
+
+
+def load():
+    """Import pykonkeio and cache its modules."""
+    global error, manager, socket, import_time
+    if error is not None:
+        return
+    start = time.monotonic()
+    socket_module = importlib.import_module('pykonkeio.socket')
+    manager_module = importlib.import_module('pykonkeio.manager')
+    error_module = importlib.import_module('pykonkeio.error')
+    import_time = time.monotonic() - start
+    socket, manager, error = socket_module, manager_module, error_module
+
+
+async def async_load(hass):
+    """Import pykonkeio without blocking the event loop."""
+    if error is None:
+        await hass.async_add_job(load)
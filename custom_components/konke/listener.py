@@ -0,0 +1,81 @@
+"""
+Push listener for Konke devices.
+
+Every heartbeat interval a single broadcast heartbeat is sent and every
+Konke device on the LAN answers it on the shared pykonkeio socket. When
+the status carried by a device's answer changes, or an offline device
+answers again, only that device is refreshed and its entities updated.
+The answers also keep the discovery inventory up to date.
+"""
+import logging
+import time
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from . import library
+
+_LOGGER = logging.getLogger(__name__)
+
+BROADCAST_ADDRESS = '255.255.255.255'
+RESPONSE_HEARTBEAT = 'hack'
+
+
+class KonkeListener(object):
+    """Receive heartbeat answers and push changes to coordinators."""
+
+    def __init__(self, hass, coordinators, inventory, interval):
+        """Initialize the listener."""
+        self.hass = hass
+        self._coordinators = coordinators
+        self._inventory = inventory
+        self._interval = interval
+        self._payloads = {}
+        self._unsub_heartbeat = None
+
+    @callback
+    def async_start(self):
+        """Start listening for heartbeat answers."""
+        library.socket.add_message_handler(self._async_handle_message)
+        self._unsub_heartbeat = async_track_time_interval(
+            self.hass, self._async_send_heartbeat, self._interval)
+        self._async_send_heartbeat()
+
+    @callback
+    def async_stop(self, event=None):
+        """Stop listening for heartbeat answers."""
+        if self._unsub_heartbeat is None:
+            return
+        self._unsub_heartbeat()
+        self._unsub_heartbeat = None
+        library.socket.remove_message_handler(self._async_handle_message)
+
+    @callback
+    def _async_send_heartbeat(self, now=None):
+        """Broadcast one heartbeat to every device on the LAN."""
+        datetime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        try:
+            library.socket.send(BROADCAST_ADDRESS, 'mac', 'nopassword', datetime, 'heart')
+        except OSError as err:
+            _LOGGER.warning('Failed to send heartbeat: %s', err)
+
+    @callback
+    def _async_handle_message(self, address, mac, password, payload, response_type):
+        """Refresh the device whose heartbeat status changed."""
+        if response_type != RESPONSE_HEARTBEAT:
+            return
+
+        self._inventory.async_seen(address, mac, password, payload)
+        coordinator = self._coordinators.get(address)
+        if coordinator is None:
+            return
+
+        prev_payload = self._payloads.get(address)
+        self._payloads[address] = payload
+        if prev_payload is None and coordinator.available:
+            return
+        if prev_payload == payload and coordinator.available:
+            return
+
+        _LOGGER.debug('Heartbeat changed %s %s', address, payload)
+        self.hass.async_add_job(coordinator.async_refresh())
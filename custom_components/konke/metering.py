@@ -0,0 +1,119 @@
+"""
+Power metering for Konke K2 plugs.
+
+The meter samples the power of a plug on its own interval, independent of
+relay polling. The latest samples are kept in a fixed-size ring buffer
+backed by an array, and the energy is integrated with the trapezoidal
+rule as samples arrive.
+"""
+import logging
+import time
+from array import array
+from datetime import timedelta
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from . import library
+from .history import KIND_POWER
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_INTERVAL = timedelta(seconds=10)
+DEFAULT_SAMPLES = 360
+
+POLL_POWER = 'power'
+
+# Samples further apart than this many intervals are not integrated.
+MAX_GAP_INTERVALS = 3
+
+
+class KonkePowerMeter(object):
+    """Sample, buffer and integrate the power of one plug."""
+
+    def __init__(self, coordinator, sample_interval=DEFAULT_SAMPLE_INTERVAL,
+                 samples=DEFAULT_SAMPLES):
+        """Initialize the power meter."""
+        self._coordinator = coordinator
+        self.sample_interval = sample_interval
+        self.energy_kwh = 0.0
+        self.power = None
+        self.power_min = None
+        self.power_max = None
+        self.power_avg = None
+        self._samples = array('f', bytes(4 * samples))
+        self._index = 0
+        self._count = 0
+        self._last_sample = None
+        self._listeners = []
+        self._unsub_sample = None
+
+    def resize(self, samples):
+        """Keep the latest samples in a ring buffer of a new size."""
+        if samples == len(self._samples):
+            return
+        ordered = self._samples[self._index:] + self._samples[:self._index]
+        kept = ordered[len(ordered) - self._count:][-samples:]
+        self._samples = array('f', bytes(4 * samples))
+        self._samples[:len(kept)] = kept
+        self._count = len(kept)
+        self._index = self._count % samples
+
+    @callback
+    def async_add_listener(self, update_callback):
+        """Subscribe a callback to new samples and start sampling."""
+        self._listeners.append(update_callback)
+        if self._unsub_sample is None:
+            self._unsub_sample = async_track_time_interval(
+                self._coordinator.hass, self._async_sample, self.sample_interval)
+
+    @callback
+    def async_remove_listener(self, update_callback):
+        """Unsubscribe a callback and stop sampling without listeners."""
+        if update_callback in self._listeners:
+            self._listeners.remove(update_callback)
+        if not self._listeners and self._unsub_sample is not None:
+            self._unsub_sample()
+            self._unsub_sample = None
+
+    async def _async_sample(self, now=None):
+        """Read the power of the plug once."""
+        device = self._coordinator.device
+        if not self._coordinator.breaker.allow():
+            self._last_sample = None
+            return
+        try:
+            await self._coordinator.queue.async_poll(
+                self._async_read, droppable=True, key=POLL_POWER)
+        except library.error.DeviceOffline:
+            _LOGGER.debug('Failed to sample power of %s', device.ip)
+            self._last_sample = None
+
+    async def _async_read(self):
+        """Read the power and record it."""
+        power = float(await self._coordinator.device.get_power())
+        self.add_sample(power, time.monotonic())
+        history = self._coordinator.history
+        if history is not None:
+            history.async_record(self._coordinator.device.ip, KIND_POWER, 0, power)
+        for update_callback in list(self._listeners):
+            update_callback()
+
+    def add_sample(self, power, timestamp):
+        """Record a power sample in W taken at a monotonic timestamp."""
+        if self._last_sample is not None:
+            prev_power, prev_timestamp = self._last_sample
+            elapsed = timestamp - prev_timestamp
+            if 0 < elapsed <= MAX_GAP_INTERVALS * self.sample_interval.total_seconds():
+                self.energy_kwh += (prev_power + power) / 2 * elapsed / 3600000
+        self._last_sample = (power, timestamp)
+
+        self._samples[self._index] = power
+        self._index = (self._index + 1) % len(self._samples)
+        self._count = min(self._count + 1, len(self._samples))
+
+        window = self._samples if self._count == len(self._samples) else self._samples[:self._count]
+        self.power = power
+        self.power_min = min(window)
+        self.power_max = max(window)
+        self.power_avg = sum(window) / self._count
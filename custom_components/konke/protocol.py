@@ -0,0 +1,60 @@
+"""
+Device protocol helpers shared by the Konke platforms and scenes.
+
+They send the fewest commands reaching a target state, working around
+what the pykonkeio device API does one command at a time.
+"""
+import asyncio
+
+
+async def async_set_klight(device, brightness=None, color=None):
+    """Set the brightness and color of a klight, in one write if both change."""
+    if brightness is not None and brightness != device.brightness:
+        # One klight write carries both brightness and color, so stage
+        # the new color locally and let set_brightness send it.
+        prev_color = device.color
+        if color is not None:
+            device.color = list(color)
+        try:
+            await device.set_brightness(brightness)
+        except Exception:
+            device.color = prev_color
+            raise
+    elif color is not None and list(color) != list(device.color):
+        await device.set_color(*color)
+
+
+async def async_set_kbulb(device, brightness=None, ct=None):
+    """Set the brightness and color temperature of a kbulb that changed."""
+    if brightness is not None and brightness != device.brightness:
+        await device.set_brightness(brightness)
+    if ct is not None and ct != device.ct:
+        await device.set_ct(ct)
+
+
+async def async_set_power_strip(device, sockets, usb):
+    """Switch power strip sockets and usb ports, given as index to bool.
+
+    Several sockets switched the same way are sent as one openall or
+    closeall command.
+    """
+    target = [sockets.get(index, device.status[index] == 'open')
+              for index in range(device.socket_count)]
+    changed = [index for index, state in sockets.items()
+               if state != (device.status[index] == 'open')]
+
+    commands = []
+    if len(changed) > 1 and all(target):
+        commands.append(device.turn_on_all())
+    elif len(changed) > 1 and not any(target):
+        commands.append(device.turn_off_all())
+    else:
+        commands.extend(
+            device.turn_on(index) if sockets[index] else device.turn_off(index)
+            for index in changed)
+    commands.extend(
+        device.turn_on_usb(index) if state else device.turn_off_usb(index)
+        for index, state in usb.items()
+        if state != (device.usb_status[index] == 'open'))
+
+    await asyncio.gather(*commands)
@@ -0,0 +1,117 @@
+"""
+Scenes of Konke devices.
+
+A scene is the raw state of every Konke device, captured from the
+coordinators without querying the devices, and persisted by name.
+Restoring a scene compares it with the current state of each device and
+only sends the commands needed to reach it.
+"""
+import logging
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+
+from .coordinator import SNAPSHOT_ATTRIBUTES
+from .protocol import async_set_kbulb, async_set_klight, async_set_power_strip
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY = 'konke.scenes'
+STORAGE_VERSION = 1
+
+OPEN = 'open'
+CLOSE = 'close'
+
+
+def capture(device):
+    """Return the raw state of a device."""
+    state = {}
+    for name in SNAPSHOT_ATTRIBUTES:
+        value = getattr(device, name, None)
+        if value is not None:
+            state[name] = list(value) if isinstance(value, list) else value
+    return state
+
+
+def diff(device, target):
+    """Return the attributes of target that differ from the device state.
+
+    The brightness, color and color temperature of a light whose target
+    is off are left as they are.
+    """
+    if _is_light(target) and target.get('status') == CLOSE:
+        target = {'status': CLOSE}
+    return {name: value for name, value in target.items()
+            if getattr(device, name, None) != value}
+
+
+def _is_light(target):
+    """Return True if target is the state of a klight or kbulb."""
+    return 'brightness' in target or 'ct' in target
+
+
+async def async_restore(device, target):
+    """Send the commands moving device to target, in device units."""
+    changes = diff(device, target)
+    if _is_light(target):
+        await _async_restore_light(device, target, changes)
+        return
+
+    status = changes.get('status')
+    usb_status = changes.get('usb_status')
+    if isinstance(status, list) or isinstance(usb_status, list):
+        await async_set_power_strip(
+            device,
+            {index: state == OPEN for index, state in enumerate(status or ())},
+            {index: state == OPEN for index, state in enumerate(usb_status or ())})
+    else:
+        if status is not None:
+            await (device.turn_on() if status == OPEN else device.turn_off())
+        if usb_status is not None:
+            await (device.turn_on_usb() if usb_status == OPEN else device.turn_off_usb())
+
+    light_status = changes.get('light_status')
+    if light_status is not None:
+        await (device.turn_on_light() if light_status == OPEN else device.turn_off_light())
+
+
+async def _async_restore_light(device, target, changes):
+    """Restore a klight or kbulb."""
+    if target.get('status') == CLOSE:
+        if 'status' in changes:
+            await device.turn_off()
+        return
+    if 'status' in changes:
+        await device.turn_on()
+
+    if 'color' in target:
+        await async_set_klight(device, target.get('brightness'), target['color'])
+    else:
+        await async_set_kbulb(device, target.get('brightness'), target.get('ct'))
+
+
+class KonkeScenes(object):
+    """Persistent scenes of Konke devices, keyed by name."""
+
+    def __init__(self, hass):
+        """Initialize the scenes."""
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._scenes = {}
+
+    async def async_load(self):
+        """Load the scenes saved by a previous run."""
+        self._scenes = await self._store.async_load() or {}
+
+    def get(self, name):
+        """Return the device states of a scene by host, or None."""
+        return self._scenes.get(name)
+
+    @callback
+    def async_snapshot(self, name, coordinators):
+        """Capture the state of every available device as a scene."""
+        scene = self._scenes[name] = {
+            host: capture(coordinator.device)
+            for host, coordinator in coordinators.items() if coordinator.available}
+        self._store.async_delay_save(lambda: self._scenes)
+        _LOGGER.debug('Captured scene %s of %s devices', name, len(scene))
+        return scene
@@ -0,0 +1,181 @@
+"""
+Instrumentation of the I/O with Konke devices.
+
+The pykonkeio methods of every device are wrapped to record the latency
+and errors of each operation, and the packets and bytes sent to each
+host are counted where pykonkeio sends them. The statistics can be
+rendered in the Prometheus text format.
+"""
+import functools
+import logging
+import time
+from bisect import bisect_left
+
+from . import library
+
+_LOGGER = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+OPERATIONS = (
+    'update', 'turn_on', 'turn_off', 'turn_on_usb', 'turn_off_usb',
+    'turn_on_light', 'turn_off_light', 'turn_on_all', 'turn_off_all',
+    'set_brightness', 'set_color', 'set_ct', 'get_power',
+    'ir_emit', 'rf_emit', 'ir_learn', 'rf_learn', 'fetch_info', 'send_message')
+
+OPERATION_REQUEST = 'send_message'
+OPERATION_INFO = 'fetch_info'
+
+_STATS = {}
+
+
+class OperationStats(object):
+    """Latency histogram and error counts of one operation."""
+
+    __slots__ = ('count', 'total', 'buckets', 'errors')
+
+    def __init__(self):
+        """Initialize the operation statistics."""
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.errors = {}
+
+    def record(self, elapsed, error=None):
+        """Record one call."""
+        self.count += 1
+        self.total += elapsed
+        self.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        if error is not None:
+            name = type(error).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    @property
+    def average(self):
+        """Return the average latency in seconds."""
+        return self.total / self.count if self.count else 0.0
+
+
+class KonkeDeviceStats(object):
+    """Statistics of the I/O with one device."""
+
+    def __init__(self, host):
+        """Initialize the device statistics."""
+        self.host = host
+        self.operations = {}
+        self.packets = 0
+        self.bytes_sent = 0
+
+    def record(self, operation, elapsed, error=None):
+        """Record one call of an operation."""
+        stats = self.operations.get(operation)
+        if stats is None:
+            stats = self.operations[operation] = OperationStats()
+        stats.record(elapsed, error)
+
+    @property
+    def requests(self):
+        """Return the number of requests made."""
+        stats = self.operations.get(OPERATION_REQUEST)
+        return stats.count if stats else 0
+
+    @property
+    def retries(self):
+        """Return the number of packets resent after a timeout."""
+        info = self.operations.get(OPERATION_INFO)
+        return max(0, self.packets - self.requests - (info.count if info else 0))
+
+    @property
+    def errors(self):
+        """Return the number of failed requests."""
+        stats = self.operations.get(OPERATION_REQUEST)
+        return sum(stats.errors.values()) if stats else 0
+
+
+def instrument_device(device):
+    """Record the I/O of a pykonkeio device and return its statistics."""
+    _install_send_hook()
+    stats = _STATS.get(device.ip)
+    if stats is None:
+        stats = _STATS[device.ip] = KonkeDeviceStats(device.ip)
+
+    for operation in OPERATIONS:
+        method = getattr(device, operation, None)
+        if method is None or getattr(method, 'konke_stats', False):
+            continue
+        setattr(device, operation, _wrap(stats, operation, method))
+    return stats
+
+
+def _wrap(stats, operation, method):
+    """Return method recording its latency and errors in stats."""
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        try:
+            result = await method(*args, **kwargs)
+        except Exception as err:
+            stats.record(operation, time.monotonic() - start, err)
+            raise
+        stats.record(operation, time.monotonic() - start)
+        return result
+
+    wrapper.konke_stats = True
+    return wrapper
+
+
+def _install_send_hook():
+    """Count the packets and bytes pykonkeio sends to each host."""
+    socket = library.socket
+    if getattr(socket.send, 'konke_stats', False):
+        return
+    send = socket.send
+
+    def counted_send(ip, mac, password, action, action_type, device_type='lan_phone'):
+        stats = _STATS.get(ip)
+        if stats is not None:
+            length = len('%s%%%s%%%s%%%s%%%s' % (device_type, mac, password, action, action_type))
+            stats.packets += 1
+            stats.bytes_sent += -(-length // 16) * 16
+        send(ip, mac, password, action, action_type, device_type)
+
+    counted_send.konke_stats = True
+    socket.send = counted_send
+
+
+def prometheus_text(stats_list, startup=None):
+    """Render device and startup statistics in the Prometheus text format."""
+    lines = [
+        '# TYPE konke_request_duration_seconds histogram',
+    ]
+    for stats in stats_list:
+        for operation, op_stats in sorted(stats.operations.items()):
+            labels = 'host="%s",operation="%s"' % (stats.host, operation)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), op_stats.buckets):
+                cumulative += count
+                lines.append('konke_request_duration_seconds_bucket{%s,le="%s"} %d' % (
+                    labels, bound, cumulative))
+            lines.append('konke_request_duration_seconds_sum{%s} %f' % (labels, op_stats.total))
+            lines.append('konke_request_duration_seconds_count{%s} %d' % (labels, op_stats.count))
+
+    lines.append('# TYPE konke_request_errors_total counter')
+    for stats in stats_list:
+        for operation, op_stats in sorted(stats.operations.items()):
+            for error, count in sorted(op_stats.errors.items()):
+                lines.append('konke_request_errors_total{host="%s",operation="%s",error="%s"} %d' % (
+                    stats.host, operation, error, count))
+
+    for name, attribute in (('packets_sent', 'packets'), ('bytes_sent', 'bytes_sent'),
+                            ('retries', 'retries')):
+        lines.append('# TYPE konke_%s_total counter' % name)
+        for stats in stats_list:
+            lines.append('konke_%s_total{host="%s"} %d' % (name, stats.host, getattr(stats, attribute)))
+
+    if startup:
+        lines.append('# TYPE konke_startup_seconds gauge')
+        for phase, seconds in sorted(startup.items()):
+            if phase != 'start' and seconds is not None:
+                lines.append('konke_startup_seconds{phase="%s"} %f' % (phase, seconds))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,44 @@
+"""
+Shared transport for Konke devices.
+
+pykonkeio sends every request over one UDP socket and matches answers by
+device MAC. It attaches a reader to that socket while requests are in
+flight and detaches it when none are, so idle periods cost a task and
+a reader registration per request. The transport keeps the reader
+attached for the lifetime of Home Assistant and bounds the number of
+requests in flight across all devices.
+"""
+import asyncio
+import logging
+
+from homeassistant.core import callback
+
+from . import library
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_IN_FLIGHT = 32
+
+
+class KonkeTransport(object):
+    """Keep the shared socket reader attached and bound requests."""
+
+    def __init__(self, hass, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        """Initialize the transport."""
+        self.hass = hass
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self._started = False
+
+    @callback
+    def async_start(self):
+        """Attach the shared socket reader."""
+        if not self._started:
+            library.socket.add_receiver(loop=self.hass.loop)
+            self._started = True
+
+    @callback
+    def async_stop(self, event=None):
+        """Detach the shared socket reader."""
+        if self._started:
+            library.socket.remove_receiver()
+            self._started = False
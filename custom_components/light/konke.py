@@ -5,12 +5,13 @@ For more details about this platform, please refer to the documentation at
 https://home-assistant.io/components/light.konke/
 """
 
+import asyncio
 import logging
 
 import voluptuous as vol
 
 from homeassistant.components.light import (
-    ATTR_BRIGHTNESS, ATTR_COLOR_TEMP, ATTR_HS_COLOR, PLATFORM_SCHEMA, SUPPORT_BRIGHTNESS,
+    ATTR_BRIGHTNESS, ATTR_COLOR_TEMP, ATTR_HS_COLOR, DOMAIN, PLATFORM_SCHEMA, SUPPORT_BRIGHTNESS,
     SUPPORT_COLOR, SUPPORT_COLOR_TEMP, Light)
 from homeassistant.const import CONF_HOST, CONF_NAME
 import homeassistant.helpers.config_validation as cv
@@ -23,8 +24,16 @@ from homeassistant.util.color import \
 from homeassistant.util.color import \
     color_RGB_to_hs as RGB_to_hs
 
+from custom_components.konke import (
+    async_add_entities_when_probed, async_register_entity, async_unregister_entity, get_coordinator,
+    library)
+from custom_components.konke.helpers import ATTR_CIRCUIT
+from custom_components.konke.protocol import async_set_kbulb, async_set_klight
+
 REQUIREMENTS = ['pykonkeio>=2.1.8']
 
+DEPENDENCIES = ['konke']
+
 _LOGGER = logging.getLogger(__name__)
 
 DEFAULT_NAME = "Konke Light"
@@ -45,28 +54,41 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
 
 KBLUB_MIN_KELVIN = 2700
 KBLUB_MAX_KELVIN = 6493
+KBLUB_MIN_MIREDS = kelvin_to_mired(KBLUB_MAX_KELVIN)
+KBLUB_MAX_MIREDS = kelvin_to_mired(KBLUB_MIN_KELVIN)
+
+WRITE_WINDOW = 0.1
+COMMAND_LIGHT = 'light'
+WRITE_ON = 'on'
+WRITE_BRIGHTNESS = 'brightness'
+WRITE_CT = 'ct'
+WRITE_COLOR = 'color'
+
+MODEL_FIELDS = {
+    MODEL_KLIGHT: ('status', 'brightness', 'color'),
+    MODEL_KBULB: ('status', 'brightness', 'ct'),
+    MODEL_K2_LIGHT: ('light_status',),
+}
 
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up Konke light platform."""
-    from pykonkeio.manager import get_device
-    from pykonkeio.error import DeviceNotSupport
-
     name = config[CONF_NAME]
     host = config[CONF_HOST]
     model = config[CONF_MODEL].lower()
 
     try:
-        device = get_device(host, model)
-    except DeviceNotSupport:
+        coordinator = get_coordinator(hass, host, model)
+    except library.error.DeviceNotSupport:
         _LOGGER.error(
             'Unsupported device found! Please create an issue at '
             'https://github.com/jedmeng/python-konkeio/issues '
             'and provide the following data: %s', model)
         return False
 
-    entity = KonkeLight(device, name, model)
-    async_add_entities([entity])
+    entity = KonkeLight(coordinator, name, model)
+    hass.async_add_job(async_add_entities_when_probed(
+        coordinator, async_add_entities, [entity], DOMAIN))
 
     _LOGGER.debug("Init %s %s %s", model, host, entity.unique_id)
 
@@ -74,17 +96,32 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
 class KonkeLight(Light):
     """Konke light device."""
 
-    def __init__(self, device, name: str, model: str):
+    def __init__(self, coordinator, name: str, model: str):
         """Initialize an Konke light."""
         self._name = name
         self._model = model
-        self._device = device
+        self._coordinator = coordinator
+        self._device = coordinator.device
+        self._pending = {}
+        self._write = None
+        self._derived_key = None
+        self._derived = (None, None, None)
+
+    @property
+    def should_poll(self) -> bool:
+        """No polling needed, the coordinator pushes updates."""
+        return False
 
     @property
     def available(self) -> bool:
         """Return True if light is available."""
         return self._device.is_online
 
+    @property
+    def device_state_attributes(self):
+        """Return the state of the circuit breaker."""
+        return {ATTR_CIRCUIT: self._coordinator.breaker.state}
+
     @property
     def unique_id(self) -> str:
         """Return unique ID for light."""
@@ -106,30 +143,46 @@ class KonkeLight(Light):
         else:
             return self._device.status == 'open'
 
+    def _get_derived(self):
+        """Return brightness, hs color and mireds, converted once per device state."""
+        device = self._device
+        color = getattr(device, 'color', None)
+        key = (getattr(device, 'brightness', None),
+               tuple(color) if color is not None else None,
+               getattr(device, 'ct', None))
+        if key != self._derived_key:
+            brightness, color, ct = key
+            self._derived = (
+                None if brightness is None else int(round(brightness * 255 / 100)),
+                None if color is None else RGB_to_hs(*color),
+                kelvin_to_mired(ct) if ct else None)
+            self._derived_key = key
+        return self._derived
+
     @property
     def brightness(self) -> int:
         """Return the brightness of the light."""
-        return self._device.brightness / 100 * 255
+        return self._get_derived()[0]
 
     @property
     def hs_color(self):
         """Return the hs color value."""
-        return RGB_to_hs(*self._device.color)
+        return self._get_derived()[1]
 
     @property
-    def color_temp(self) -> float:
+    def color_temp(self) -> int:
         """Return the color temperature of this light."""
-        return kelvin_to_mired(self._device.ct)
+        return self._get_derived()[2]
 
     @property
-    def min_mireds(self) -> float:
+    def min_mireds(self) -> int:
         """Return minimum supported color temperature."""
-        return kelvin_to_mired(KBLUB_MAX_KELVIN)
+        return KBLUB_MIN_MIREDS
 
     @property
-    def max_mireds(self) -> float:
+    def max_mireds(self) -> int:
         """Return maximum supported color temperature."""
-        return kelvin_to_mired(KBLUB_MIN_KELVIN)
+        return KBLUB_MAX_MIREDS
 
     @property
     def supported_features(self) -> int:
@@ -144,42 +197,85 @@ class KonkeLight(Light):
     async def async_turn_on(self, **kwargs) -> None:
         """Instruct the light to turn on."""
         _LOGGER.debug("Turn on light %s %s", self._device.ip, kwargs)
-        if not self.is_on:
-            if self._model == MODEL_K2_LIGHT:
-                await self._device.turn_on_light()
-            else:
-                await self._device.turn_on()
-
-        if ATTR_BRIGHTNESS in kwargs and \
-                self.brightness != kwargs[ATTR_BRIGHTNESS]:
-            await self._device.set_brightness(int(round(kwargs[ATTR_BRIGHTNESS] * 100 / 255)))
-
-        if ATTR_COLOR_TEMP in kwargs and \
-                self.color_temp != kwargs[ATTR_COLOR_TEMP]:
-            await self._device.set_ct(mired_to_kelvin(kwargs[ATTR_COLOR_TEMP]))
-
-        if ATTR_HS_COLOR in kwargs and \
-                self.hs_color != kwargs[ATTR_HS_COLOR]:
-            hs_color = kwargs[ATTR_HS_COLOR]
-            rgb_color = hs_to_RGB(*hs_color)
-            await self._device.set_color(*rgb_color)
+        changes = {WRITE_ON: True}
+        if ATTR_BRIGHTNESS in kwargs:
+            changes[WRITE_BRIGHTNESS] = int(round(kwargs[ATTR_BRIGHTNESS] * 100 / 255))
+        if ATTR_COLOR_TEMP in kwargs:
+            changes[WRITE_CT] = mired_to_kelvin(kwargs[ATTR_COLOR_TEMP])
+        if ATTR_HS_COLOR in kwargs:
+            changes[WRITE_COLOR] = list(hs_to_RGB(*kwargs[ATTR_HS_COLOR]))
+
+        if self._pending.get(WRITE_ON) is False:
+            self._pending = changes
+        else:
+            self._pending.update(changes)
+        await self._async_schedule_write()
 
     async def async_turn_off(self, **kwargs) -> None:
         """Instruct the light to turn off."""
-
-        if self._model == MODEL_K2_LIGHT:
-            await self._device.turn_off_light()
-        else:
-            await self._device.turn_off()
         _LOGGER.debug("Turn off light %s", self._device.ip)
+        self._pending = {WRITE_ON: False}
+        await self._async_schedule_write()
+
+    async def _async_schedule_write(self) -> None:
+        """Wait until the write containing the pending changes is sent."""
+        if self._write is None:
+            self._write = asyncio.ensure_future(self._async_write_later())
+        await asyncio.shield(self._write)
+
+    async def _async_write_later(self) -> None:
+        """Send the latest changes made within the write window at once."""
+        await asyncio.sleep(WRITE_WINDOW)
+        self._write = None
+        pending = self._pending
+        try:
+            await self._coordinator.async_command(COMMAND_LIGHT, self._async_write)
+        except Exception:
+            # Changes rejected before they were sent, e.g. by an open
+            # circuit breaker, must not leak into the next command.
+            if self._pending is pending:
+                self._pending = {}
+            raise
+
+    async def _async_write(self) -> None:
+        """Send the pending changes with as few commands as possible."""
+        changes, self._pending = self._pending, {}
+        if not changes:
+            return
+
+        device = self._device
+        if not changes[WRITE_ON]:
+            if self._model == MODEL_K2_LIGHT:
+                await device.turn_off_light()
+            else:
+                await device.turn_off()
+            return
+
+        if not self.is_on:
+            if self._model == MODEL_K2_LIGHT:
+                await device.turn_on_light()
+            else:
+                await device.turn_on()
+
+        if self._model == MODEL_KLIGHT:
+            await async_set_klight(
+                device, changes.get(WRITE_BRIGHTNESS), changes.get(WRITE_COLOR))
+        elif self._model == MODEL_KBULB:
+            await async_set_kbulb(
+                device, changes.get(WRITE_BRIGHTNESS), changes.get(WRITE_CT))
+
+    async def async_added_to_hass(self) -> None:
+        """Subscribe to device updates."""
+        async_register_entity(self.hass, self)
+        self._coordinator.async_add_listener(
+            self.async_schedule_update_ha_state, MODEL_FIELDS[self._model])
+
+    async def async_will_remove_from_hass(self) -> None:
+        """Unsubscribe from device updates."""
+        async_unregister_entity(self.hass, self)
+        self._coordinator.async_remove_listener(self.async_schedule_update_ha_state)
 
     async def async_update(self) -> None:
         """Synchronize state with light."""
-        from pykonkeio.error import DeviceOffline
-        prev_available = self.available
-        try:
-            await self._device.update(type='light')
-        except DeviceOffline:
-            if prev_available:
-                _LOGGER.warning('Device is offline %s', self.entity_id)
+        await self._coordinator.async_refresh()
 
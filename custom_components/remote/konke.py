@@ -6,25 +6,33 @@ https://home-assistant.io/components/remote.konke/
 """
 import asyncio
 import logging
+from functools import lru_cache, partial
 
 import voluptuous as vol
 
 from homeassistant.components.remote import (
     PLATFORM_SCHEMA, DOMAIN, ATTR_NUM_REPEATS, ATTR_DELAY_SECS,
-    DEFAULT_DELAY_SECS, RemoteDevice)
+    DEFAULT_DELAY_SECS, DEFAULT_NUM_REPEATS, RemoteDevice)
 from homeassistant.const import (
     CONF_NAME, CONF_HOST, CONF_TIMEOUT, CONF_TYPE,
     ATTR_ENTITY_ID, CONF_COMMAND)
 import homeassistant.helpers.config_validation as cv
 
+from custom_components.konke import (
+    DATA_CODES, async_add_entities_when_probed, get_coordinator, get_inventory_info)
+from custom_components.konke.codes import NAMED_SLOT_MIN
+from custom_components.konke.helpers import ATTR_CIRCUIT
+
 REQUIREMENTS = ['pykonkeio>=2.1.8']
 
+DEPENDENCIES = ['konke']
+
 _LOGGER = logging.getLogger(__name__)
 
 SERVICE_IR_LEARN = 'koneke_ir_learn'
 SERVICE_RF_LEARN = 'koneke_rf_learn'
 DATA_KEY = 'remote.konke_remote'
-SOLT_RANGE = {"min": 1000, "max": 999999}
+SOLT_RANGE = {"min": 1000, "max": NAMED_SLOT_MIN - 1}
 
 CONF_HIDDEN = 'hidden'
 CONF_MODEL = 'model'
@@ -33,18 +41,26 @@ MODEL_K2 = ['k2', 'k2 pro']
 MODEL_MINIK = ['minik', 'minik pro']
 TYPE_IR = 'ir'
 TYPE_RF = 'rf'
+TYPE_DELAY = 'delay'
+TYPE_NAME = 'name'
+
+SERVICE_TYPES = {
+    SERVICE_IR_LEARN: TYPE_IR,
+    SERVICE_RF_LEARN: TYPE_RF,
+}
 
 DEFAULT_NAME = 'konke_remote'
 DEFAULT_TIMEOUT = 10
 DEFAULT_SLOT = 1001
 
-ENTITIES = []
+DATA_REMOTES = 'remote.konke_remotes'
 
-LEARN_COMMAND_SCHEMA = vol.Schema({
+LEARN_COMMAND_SCHEMA = vol.All(vol.Schema({
     vol.Required(ATTR_ENTITY_ID): vol.All(str),
-    vol.Required(CONF_SLOT): vol.All(int, vol.Range(**SOLT_RANGE)),
+    vol.Exclusive(CONF_SLOT, 'code'): vol.All(int, vol.Range(**SOLT_RANGE)),
+    vol.Exclusive(CONF_NAME, 'code'): cv.string,
     vol.Optional(CONF_TIMEOUT, default=10): vol.All(int, vol.Range(min=0)),
-})
+}), cv.has_at_least_one_key(CONF_SLOT, CONF_NAME))
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
@@ -57,35 +73,52 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the Konke Remote platform."""
-    from pykonkeio.manager import get_device
-
     name = config[CONF_NAME]
     host = config[CONF_HOST]
     model = config[CONF_MODEL]
     hidden = config[CONF_HIDDEN]
     remote_type = config[CONF_TYPE]
 
-    entity = KonkeRemote(get_device(host, model), name, remote_type, hidden)
-    async_add_entities([entity])
+    info = get_inventory_info(hass, host)
+    if info is not None and not info[remote_type]:
+        _LOGGER.warning('Device at %s reported no %s module', host, remote_type)
+
+    coordinator = get_coordinator(hass, host, model)
+    entity = KonkeRemote(coordinator, name, remote_type, hidden)
+    hass.async_add_job(async_add_entities_when_probed(
+        coordinator, async_add_entities, [entity], DOMAIN))
 
-    ENTITIES.append(entity)
+    _async_register_services(hass)
+
+
+def _async_register_services(hass):
+    """Register the learn services once for every Konke remote."""
+    if hass.services.has_service(DOMAIN, SERVICE_IR_LEARN):
+        return
 
     async def async_service_handler(service):
         """Handle a learn command."""
-        if service.service not in (SERVICE_IR_LEARN, SERVICE_RF_LEARN):
+        remote_type = SERVICE_TYPES.get(service.service)
+        if remote_type is None:
             _LOGGER.error("We should not handle service: %s", service.service)
             return
 
         entity_id = service.data[ATTR_ENTITY_ID]
+        entity = hass.data.get(DATA_REMOTES, {}).get(entity_id)
 
-        entities = [_entity for _entity in ENTITIES if _entity.entity_id in entity_id]
-
-        if len(entities) == 0:
+        if entity is None:
             _LOGGER.error("Entity_id: '%s' not found", entity_id)
             return
+        if entity.type.lower() != remote_type:
+            _LOGGER.error("Entity_id: '%s' is not a %s remote", entity_id, remote_type)
+            return
 
+        codes = hass.data[DATA_CODES]
+        name = service.data.get(CONF_NAME)
         slot = service.data.get(CONF_SLOT)
         timeout = service.data.get(CONF_TIMEOUT)
+        if slot is None:
+            slot = codes.async_allocate(remote_type, name)
 
         log_title = 'Konke %s Remote' % entity.type
         log_message = 'Start learning %s remote, please press any key you want to learn on the remote.' % entity.type
@@ -93,7 +126,14 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
 
         _LOGGER.debug('Start learning %s remote on slot %s: %s', entity.type, slot, entity_id)
 
-        result = await hass.async_add_job(entity.async_learn, slot, timeout)
+        result = False
+        try:
+            result = await entity.async_learn(slot, timeout)
+        finally:
+            if name is not None and result:
+                codes.async_commit(remote_type, name)
+            elif name is not None:
+                codes.async_release(remote_type, name)
 
         if result:
             log_message = 'Learn %s remote success on slot %s' % (entity.type, slot)
@@ -104,22 +144,54 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
             hass.components.persistent_notification.async_create(log_message, log_title, notification_id=entity_id)
             _LOGGER.debug('Learn %s remote failed on slot %s: %s', entity.type, slot, entity_id)
 
-    if remote_type == TYPE_IR:
-        hass.services.async_register(DOMAIN, SERVICE_IR_LEARN, async_service_handler, schema=LEARN_COMMAND_SCHEMA)
-    elif remote_type == TYPE_RF:
-        hass.services.async_register(DOMAIN, SERVICE_RF_LEARN, async_service_handler, schema=LEARN_COMMAND_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_IR_LEARN, async_service_handler, schema=LEARN_COMMAND_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_RF_LEARN, async_service_handler, schema=LEARN_COMMAND_SCHEMA)
+
+
+@lru_cache(maxsize=64)
+def compile_command(command, remote_type):
+    """Compile command strings into (type, value) steps.
+
+    'ir_1001' emits the code in slot 1001 and 'delay_0.5' waits half a
+    second more before the next step. Anything else, such as 'tv_1', is
+    the name of a code in the code library.
+    """
+    steps = []
+    for item in command:
+        step_type, _, value = item.partition('_')
+        if step_type not in (TYPE_IR, TYPE_RF, TYPE_DELAY):
+            steps.append((TYPE_NAME, item))
+            continue
+        try:
+            value = float(value) if step_type == TYPE_DELAY else int(value)
+        except ValueError:
+            steps.append((TYPE_NAME, item))
+            continue
+
+        if step_type not in (TYPE_DELAY, remote_type):
+            _LOGGER.warning("Illegal command type: %s", item)
+            continue
+        steps.append((step_type, value))
+    return tuple(steps)
 
 
 class KonkeRemote(RemoteDevice):
     """Representation of a Konke Remote device."""
 
-    def __init__(self, device, name, remote_type, hidden):
+    def __init__(self, coordinator, name, remote_type, hidden):
         """Initialize the remote."""
         self._name = name
-        self._device = device
+        self._coordinator = coordinator
+        self._device = coordinator.device
         self._is_hidden = hidden
         self._type = remote_type
         self._state = False
+        self._macro = None
+
+    @property
+    def device_state_attributes(self):
+        """Return the state of the circuit breaker."""
+        return {ATTR_CIRCUIT: self._coordinator.breaker.state}
 
     @property
     def unique_id(self) -> str:
@@ -158,6 +230,11 @@ class KonkeRemote(RemoteDevice):
         """Return if we should hide entity."""
         return self._is_hidden
 
+    @property
+    def should_poll(self) -> bool:
+        """No polling needed, the coordinator pushes updates."""
+        return False
+
     @asyncio.coroutine
     def async_turn_on(self, **kwargs) -> None:
         """Turn the device on."""
@@ -170,44 +247,76 @@ class KonkeRemote(RemoteDevice):
         _LOGGER.error("Device does not support turn_off, "
                       "please use 'remote.send_command' to send commands.")
 
-    async def async_update(self):
-        from pykonkeio.error import DeviceOffline
-        prev_available = self.available
-        try:
-            await self._device.update()
-        except DeviceOffline:
-            if prev_available:
-                _LOGGER.warning('Device is offline %s', self.unique_id)
+    async def async_added_to_hass(self):
+        """Subscribe to device updates."""
+        self.hass.data.setdefault(DATA_REMOTES, {})[self.entity_id] = self
+        self._coordinator.async_add_listener(
+            self.async_schedule_update_ha_state, ('is_support_%s' % self._type,))
 
-    async def _do_send_command(self, command):
-        """Send a command."""
-        try:
-            command_type, slot = command.split('_')
-        except ValueError:
-            _LOGGER.warning("Illegal command format: %s", command)
-            return False
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from device updates."""
+        self.hass.data.get(DATA_REMOTES, {}).pop(self.entity_id, None)
+        self._coordinator.async_remove_listener(self.async_schedule_update_ha_state)
 
-        if self._type != command_type:
-            _LOGGER.warning("Illegal command type: %s", command)
-            return False
+    async def async_update(self):
+        """Synchronize state with remote."""
+        await self._coordinator.async_refresh()
+
+    async def _async_emit(self, slot):
+        """Emit the code learned in slot."""
         if self._type == TYPE_IR:
-            return await self._device.ir_emit(slot)
+            await self._device.ir_emit(slot)
         elif self._type == TYPE_RF:
-            return await self._device.rf_emit(slot)
+            await self._device.rf_emit(slot)
+
+    async def _async_run_macro(self, steps, num_repeats, delay):
+        """Emit compiled steps, each one delay after the previous one.
+
+        Steps keep to a fixed schedule, but a send that runs late still
+        leaves delay before the next one.
+        """
+        loop = self.hass.loop
+        codes = self.hass.data[DATA_CODES]
+        deadline = loop.time()
+        for _ in range(num_repeats):
+            for step_type, value in steps:
+                if step_type == TYPE_DELAY:
+                    deadline += value
+                    continue
+                if step_type == TYPE_NAME:
+                    name, value = value, codes.get(self._type, value)
+                    if value is None:
+                        _LOGGER.warning("Unknown command name: %s", name)
+                        continue
+                await asyncio.sleep(max(0, deadline - loop.time()))
+                await self._coordinator.async_send(
+                    None, partial(self._async_emit, value))
+                deadline = max(deadline, loop.time()) + delay
 
     async def async_send_command(self, command, **kwargs) -> None:
-        """Send a command."""
-        num_repeats = kwargs.get(ATTR_NUM_REPEATS)
+        """Send a command, cancelling the one still being sent."""
+        num_repeats = kwargs.get(ATTR_NUM_REPEATS, DEFAULT_NUM_REPEATS)
         delay = kwargs.get(ATTR_DELAY_SECS, DEFAULT_DELAY_SECS)
+        steps = compile_command(tuple(command), self._type)
 
-        for _ in range(num_repeats):
-            for item in command:
-                await self._do_send_command(item)
-                await asyncio.sleep(delay)
+        if self._macro is not None:
+            self._macro.cancel()
+        macro = self._macro = self.hass.loop.create_task(
+            self._async_run_macro(steps, num_repeats, delay))
+        try:
+            await macro
+        except asyncio.CancelledError:
+            if self._macro is macro:
+                raise
+            _LOGGER.debug("Command superseded on %s", self.entity_id)
+        finally:
+            if self._macro is macro:
+                self._macro = None
 
     async def async_learn(self, command, timeout=DEFAULT_TIMEOUT) -> bool:
-        """Learn a command."""
-        if self._type == TYPE_IR:
-            return await self._device.ir_learn(command, timeout=timeout)
-        elif self._type == TYPE_RF:
-            return await self._device.rf_learn(command, timeout=timeout)
+        """Learn a command, one learn session per device at a time."""
+        async with self._coordinator.learn_lock:
+            if self._type == TYPE_IR:
+                return await self._device.ir_learn(command, timeout=timeout)
+            elif self._type == TYPE_RF:
+                return await self._device.rf_learn(command, timeout=timeout)
@@ -0,0 +1,228 @@
+"""
+Support for the energy and diagnostics sensors of Konke devices.
+
+For more details about this platform, please refer to the documentation at
+https://home-assistant.io/components/sensor.konke/
+"""
+
+import logging
+
+import voluptuous as vol
+
+from homeassistant.components.sensor import DOMAIN, PLATFORM_SCHEMA
+from homeassistant.const import CONF_NAME, CONF_HOST, CONF_TYPE
+import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.restore_state import RestoreEntity
+
+from custom_components.konke import (
+    async_add_entities_when_probed, get_coordinator, get_inventory_info, library)
+from custom_components.konke.discovery import ATTR_MODEL
+from custom_components.konke.helpers import ATTR_CIRCUIT
+from custom_components.konke.metering import DEFAULT_SAMPLE_INTERVAL, DEFAULT_SAMPLES
+
+REQUIREMENTS = ['pykonkeio>=2.1.8']
+
+DEPENDENCIES = ['konke']
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_NAME = 'Konke Energy'
+
+CONF_MODEL = 'model'
+CONF_SAMPLE_INTERVAL = 'sample_interval'
+CONF_SAMPLES = 'samples'
+MODEL_K2 = ['k2', 'k2 pro']
+MODELS = ['smart plugin', 'k1', 'minik', 'minik pro', 'mul', 'micmul', 'klight', 'kbulb'] + MODEL_K2
+TYPE_ENERGY = 'energy'
+TYPE_DIAGNOSTICS = 'diagnostics'
+
+ATTR_POWER = 'current_power_w'
+ATTR_POWER_MIN = 'min_power_w'
+ATTR_POWER_MAX = 'max_power_w'
+ATTR_POWER_AVG = 'avg_power_w'
+
+ATTR_REQUESTS = 'requests'
+ATTR_ERRORS = 'errors'
+ATTR_RETRIES = 'retries'
+ATTR_PACKETS = 'packets_sent'
+ATTR_BYTES = 'bytes_sent'
+
+UNIT_KWH = 'kWh'
+UNIT_MS = 'ms'
+
+PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
+    vol.Required(CONF_HOST): cv.string,
+    vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
+    vol.Optional(CONF_MODEL): vol.In(MODELS),
+    vol.Optional(CONF_TYPE, default=TYPE_ENERGY): vol.In((TYPE_ENERGY, TYPE_DIAGNOSTICS)),
+    vol.Optional(CONF_SAMPLE_INTERVAL, default=DEFAULT_SAMPLE_INTERVAL): cv.time_period,
+    vol.Optional(CONF_SAMPLES, default=DEFAULT_SAMPLES): vol.All(int, vol.Range(min=1)),
+})
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """Set up Konke sensor platform."""
+    name = config[CONF_NAME]
+    host = config[CONF_HOST]
+    model = config.get(CONF_MODEL)
+    sensor_type = config[CONF_TYPE]
+
+    if model is None and sensor_type == TYPE_ENERGY:
+        model = MODEL_K2[0]
+    elif model is None:
+        # Never guess: a wrong model would create the wrong device handle
+        # for the host, shared with the other platforms.
+        model = (get_inventory_info(hass, host) or {}).get(ATTR_MODEL)
+        if model is None:
+            _LOGGER.error('Model of %s is unknown, please set it in the configuration', host)
+            return False
+    model = model.lower()
+
+    if sensor_type == TYPE_ENERGY and model not in MODEL_K2:
+        _LOGGER.error('Energy is only measured by K2, not %s', model)
+        return False
+
+    try:
+        coordinator = get_coordinator(hass, host, model)
+    except library.error.DeviceNotSupport:
+        _LOGGER.error(
+            'Unsupported device found! Please create an issue at '
+            'https://github.com/jedmeng/python-konkeio/issues '
+            'and provide the following data: %s', model)
+        return False
+
+    if sensor_type == TYPE_DIAGNOSTICS:
+        entity = KonkeDiagnosticsSensor(coordinator, name)
+    else:
+        meter = coordinator.get_power_meter(config[CONF_SAMPLE_INTERVAL])
+        meter.resize(config[CONF_SAMPLES])
+        entity = KonkeEnergySensor(coordinator, meter, name)
+    hass.async_add_job(async_add_entities_when_probed(
+        coordinator, async_add_entities, [entity], DOMAIN))
+
+
+class KonkeEnergySensor(RestoreEntity):
+    """Energy used by a Konke K2 plug."""
+
+    def __init__(self, coordinator, meter, name: str):
+        """Initialize the energy sensor."""
+        self._name = name
+        self._coordinator = coordinator
+        self._meter = meter
+
+    @property
+    def should_poll(self) -> bool:
+        """No polling needed, the power meter pushes updates."""
+        return False
+
+    @property
+    def available(self) -> bool:
+        """Return True if the plug is available."""
+        return self._coordinator.available
+
+    @property
+    def unique_id(self):
+        """Return unique ID for sensor."""
+        return '%s:energy' % self._coordinator.unique_id
+
+    @property
+    def name(self):
+        """Return the display name of this sensor."""
+        return self._name
+
+    @property
+    def state(self):
+        """Return the energy used in kWh."""
+        return round(self._meter.energy_kwh, 3)
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of the energy."""
+        return UNIT_KWH
+
+    @property
+    def device_state_attributes(self):
+        """Return the power statistics of the sample window."""
+        return {
+            ATTR_POWER: self._meter.power,
+            ATTR_POWER_MIN: self._meter.power_min,
+            ATTR_POWER_MAX: self._meter.power_max,
+            ATTR_POWER_AVG: self._meter.power_avg,
+        }
+
+    async def async_added_to_hass(self):
+        """Restore the energy total and subscribe to power updates."""
+        await super().async_added_to_hass()
+        last_state = await self.async_get_last_state()
+        if last_state is not None:
+            try:
+                self._meter.energy_kwh += float(last_state.state)
+            except ValueError:
+                _LOGGER.warning('Could not restore energy of %s: %s', self.entity_id, last_state.state)
+        self._meter.async_add_listener(self.async_schedule_update_ha_state)
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from power updates."""
+        self._meter.async_remove_listener(self.async_schedule_update_ha_state)
+
+
+class KonkeDiagnosticsSensor(Entity):
+    """Request statistics of a Konke device."""
+
+    def __init__(self, coordinator, name: str):
+        """Initialize the diagnostics sensor."""
+        self._name = name
+        self._coordinator = coordinator
+        self._stats = coordinator.stats
+
+    @property
+    def should_poll(self) -> bool:
+        """Poll the statistics, they change with every request."""
+        return True
+
+    @property
+    def unique_id(self):
+        """Return unique ID for sensor."""
+        return '%s:diagnostics' % self._coordinator.unique_id
+
+    @property
+    def name(self):
+        """Return the display name of this sensor."""
+        return self._name
+
+    @property
+    def state(self):
+        """Return the average request latency in ms."""
+        stats = self._stats.operations.get('send_message')
+        return None if stats is None else round(stats.average * 1000, 1)
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of the latency."""
+        return UNIT_MS
+
+    @property
+    def device_state_attributes(self):
+        """Return the counters and per operation statistics."""
+        attributes = {
+            ATTR_REQUESTS: self._stats.requests,
+            ATTR_ERRORS: self._stats.errors,
+            ATTR_RETRIES: self._stats.retries,
+            ATTR_PACKETS: self._stats.packets,
+            ATTR_BYTES: self._stats.bytes_sent,
+            ATTR_CIRCUIT: self._coordinator.breaker.state,
+        }
+        for operation, stats in self._stats.operations.items():
+            attributes['%s_count' % operation] = stats.count
+            attributes['%s_avg_ms' % operation] = round(stats.average * 1000, 1)
+            attributes['%s_errors' % operation] = sum(stats.errors.values())
+        return attributes
+
+    async def async_added_to_hass(self):
+        """Keep the device polled and follow its availability."""
+        self._coordinator.async_add_listener(self.async_schedule_update_ha_state, ())
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from device updates."""
+        self._coordinator.async_remove_listener(self.async_schedule_update_ha_state)
@@ -5,17 +5,26 @@ For more details about this platform, please refer to the documentation at
 https://home-assistant.io/components/switch.konke/
 """
 
+import asyncio
 import logging
-import time
 
 import voluptuous as vol
 
-from homeassistant.components.switch import SwitchDevice, PLATFORM_SCHEMA
-from homeassistant.const import CONF_NAME, CONF_HOST
+from homeassistant.components.switch import DOMAIN, SwitchDevice, PLATFORM_SCHEMA
+from homeassistant.const import ATTR_ENTITY_ID, CONF_NAME, CONF_HOST
 import homeassistant.helpers.config_validation as cv
 
+from custom_components.konke import (
+    async_add_entities_when_probed, async_register_entity, async_unregister_entity,
+    get_coordinator, get_inventory_info, library)
+from custom_components.konke.discovery import ATTR_MODEL
+from custom_components.konke.helpers import ATTR_CIRCUIT
+from custom_components.konke.protocol import async_set_power_strip
+
 REQUIREMENTS = ['pykonkeio>=2.1.8']
 
+DEPENDENCIES = ['konke']
+
 _LOGGER = logging.getLogger(__name__)
 
 DEFAULT_NAME = 'Konke Outlet'
@@ -30,7 +39,15 @@ MODEL_MICMUL = ['micmul']
 MODEL_SWITCH = MODEL_K1 + MODEL_K2 + MODEL_MINIK
 MODEL_POWER_STRIP = MODEL_MUL + MODEL_MICMUL
 
-UPDATE_DEBONCE = 0.3
+BATCH_WINDOW = 0.05
+
+COMMAND_RELAY = 'relay'
+COMMAND_USB = 'usb'
+
+SERVICE_SET_POWER_STRIP = 'konke_set_power_strip'
+DATA_POWER_STRIPS = 'switch.konke_power_strips'
+ATTR_SOCKETS = 'sockets'
+ATTR_USB = 'usb'
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Required(CONF_HOST): cv.string,
@@ -38,59 +55,108 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Optional(CONF_MODEL): vol.In(MODEL_SWITCH + MODEL_POWER_STRIP)
 })
 
+SET_POWER_STRIP_SCHEMA = vol.Schema({
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional(ATTR_SOCKETS): vol.All(vol.Coerce(int), vol.Range(min=0)),
+    vol.Optional(ATTR_USB): vol.All(vol.Coerce(int), vol.Range(min=0)),
+})
+
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up Konke switch platform."""
-    from pykonkeio.manager import get_device
-    from pykonkeio.error import DeviceNotSupport
-
     name = config[CONF_NAME]
     host = config[CONF_HOST]
-    model = config[CONF_MODEL].lower()
+    model = config.get(CONF_MODEL)
     entities = []
 
+    if model is None:
+        model = (get_inventory_info(hass, host) or {}).get(ATTR_MODEL)
+        if model is None:
+            _LOGGER.error('Model of %s is unknown, please set it in the configuration', host)
+            return False
+    model = model.lower()
+
     try:
-        device = get_device(host, model)
-    except DeviceNotSupport:
+        coordinator = get_coordinator(hass, host, model)
+    except library.error.DeviceNotSupport:
         _LOGGER.error(
             'Unsupported device found! Please create an issue at '
             'https://github.com/jedmeng/python-konkeio/issues '
             'and provide the following data: %s', model)
         return False
 
+    device = coordinator.device
     if hasattr(device, 'socket_count'):
-        powerstrip = KonkePowerStrip(device, name)
+        powerstrip = KonkePowerStrip(coordinator, name)
         for i in range(device.socket_count):
             entities.append(KonkePowerStripOutlet(powerstrip, name, i))
 
         for i in range(device.usb_count if hasattr(device, 'usb_count') else 0):
             entities.append(KonkePowerStripUSB(powerstrip, name, i))
+
+        powerstrip.entities = entities
+        hass.data.setdefault(DATA_POWER_STRIPS, []).append(powerstrip)
+        _async_register_services(hass)
     else:
-        entities.append(KonkeOutlet(name, device, model))
+        entities.append(KonkeOutlet(name, coordinator, model))
         if hasattr(device, 'usb_status'):
-            entities.append(KonkeUsbSwitch(name, device))
+            entities.append(KonkeUsbSwitch(name, coordinator))
+
+    hass.async_add_job(async_add_entities_when_probed(
+        coordinator, async_add_entities, entities, DOMAIN))
+
+
+def _async_register_services(hass):
+    """Register the power strip services once."""
+    if hass.services.has_service(DOMAIN, SERVICE_SET_POWER_STRIP):
+        return
 
-    async_add_entities(entities)
+    async def async_service_handler(service):
+        """Set all sockets and usb ports of power strips at once."""
+        entity_ids = service.data[ATTR_ENTITY_ID]
+        sockets = service.data.get(ATTR_SOCKETS)
+        usb = service.data.get(ATTR_USB)
+
+        powerstrips = [
+            powerstrip for powerstrip in hass.data[DATA_POWER_STRIPS]
+            if any(entity.entity_id in entity_ids for entity in powerstrip.entities)]
+
+        if not powerstrips:
+            _LOGGER.error("Entity_id: '%s' not found", entity_ids)
+            return
+
+        await asyncio.gather(*[
+            powerstrip.async_set_bitmap(sockets, usb) for powerstrip in powerstrips])
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_SET_POWER_STRIP, async_service_handler,
+        schema=SET_POWER_STRIP_SCHEMA)
 
 
 class KonkeOutlet(SwitchDevice):
 
-    def __init__(self, name, device, model=None):
+    def __init__(self, name, coordinator, model=None):
         self._name = name
-        self._device = device
+        self._coordinator = coordinator
+        self._device = coordinator.device
         self._model = model
-        self._current_power_w = None
+        self._meter = coordinator.get_power_meter() if model in MODEL_K2 else None
 
     @property
     def should_poll(self) -> bool:
-        """Poll the plug."""
-        return True
+        """No polling needed, the coordinator pushes updates."""
+        return False
 
     @property
     def available(self) -> bool:
         """Return True if outlet is available."""
         return self._device.is_online
 
+    @property
+    def device_state_attributes(self):
+        """Return the state of the circuit breaker."""
+        return {ATTR_CIRCUIT: self._coordinator.breaker.state}
+
     @property
     def unique_id(self):
         """Return unique ID for switch."""
@@ -109,56 +175,73 @@ class KonkeOutlet(SwitchDevice):
     @property
     def current_power_w(self):
         """Return the current power usage in W."""
-        return self._current_power_w
+        if self._meter is None:
+            return None
+        return self._meter.power
 
     async def async_turn_on(self, **kwargs):
         """Instruct the outlet to turn on."""
-        await self._device.turn_on()
+        await self._coordinator.async_command(COMMAND_RELAY, self._device.turn_on)
         _LOGGER.debug("Turn on outlet %s", self.unique_id)
 
     async def async_turn_off(self, **kwargs):
         """Instruct the outlet to turn off."""
-        await self._device.turn_off()
+        await self._coordinator.async_command(COMMAND_RELAY, self._device.turn_off)
         _LOGGER.debug("Turn off outlet %s", self.unique_id)
 
+    async def async_added_to_hass(self):
+        """Subscribe to device and power updates."""
+        async_register_entity(self.hass, self)
+        self._coordinator.async_add_listener(self.async_schedule_update_ha_state, ('status',))
+        if self._meter is not None:
+            self._meter.async_add_listener(self.async_schedule_update_ha_state)
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from device and power updates."""
+        async_unregister_entity(self.hass, self)
+        self._coordinator.async_remove_listener(self.async_schedule_update_ha_state)
+        if self._meter is not None:
+            self._meter.async_remove_listener(self.async_schedule_update_ha_state)
+
     async def async_update(self):
         """Synchronize state with outlet."""
-        from pykonkeio.error import DeviceOffline
-        prev_available = self.available
-        try:
-            await self._device.update(type='relay')
-
-            if self._model in MODEL_K2:
-                self._current_power_w = await self._device.get_power()
-        except DeviceOffline:
-            if prev_available:
-                _LOGGER.warning('Device is offline %s', self.entity_id)
+        await self._coordinator.async_refresh()
 
 
 class KonkeUsbSwitch(SwitchDevice):
-    def __init__(self, name, device):
-        self._name = name
-        self._device = device
+
+    def __init__(self, name, coordinator):
+        self._name = '%s_usb' % name
+        self._coordinator = coordinator
+        self._device = coordinator.device
+        self._unique_id = None
 
     @property
     def should_poll(self) -> bool:
-        """Poll the plug."""
-        return True
+        """No polling needed, the coordinator pushes updates."""
+        return False
 
     @property
     def available(self) -> bool:
         """Return True if outlet is available."""
         return self._device.is_online
 
+    @property
+    def device_state_attributes(self):
+        """Return the state of the circuit breaker."""
+        return {ATTR_CIRCUIT: self._coordinator.breaker.state}
+
     @property
     def unique_id(self):
         """Return unique ID for switch."""
-        return '%s:usb' % self._device.uuid
+        if self._unique_id is None and self._device.uuid is not None:
+            self._unique_id = '%s:usb' % self._device.uuid
+        return self._unique_id
 
     @property
     def name(self):
         """Return the display name of this outlet."""
-        return '%s_usb' % self._name
+        return self._name
 
     @property
     def is_on(self):
@@ -167,38 +250,62 @@ class KonkeUsbSwitch(SwitchDevice):
 
     async def async_turn_on(self, **kwargs):
         """Instruct the outlet to turn on."""
-        await self._device.turn_on_usb()
+        await self._coordinator.async_command(COMMAND_USB, self._device.turn_on_usb)
         _LOGGER.debug("Turn on usb %s", self.unique_id)
 
     async def async_turn_off(self, **kwargs):
         """Instruct the outlet to turn off."""
-        await self._device.turn_off_usb()
+        await self._coordinator.async_command(COMMAND_USB, self._device.turn_off_usb)
         _LOGGER.debug("Turn off usb %s", self.unique_id)
 
+    async def async_added_to_hass(self):
+        """Subscribe to device updates."""
+        async_register_entity(self.hass, self)
+        self._coordinator.async_add_listener(self.async_schedule_update_ha_state, ('usb_status',))
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from device updates."""
+        async_unregister_entity(self.hass, self)
+        self._coordinator.async_remove_listener(self.async_schedule_update_ha_state)
+
     async def async_update(self):
         """Synchronize state with outlet."""
-        from pykonkeio.error import DeviceOffline
-        prev_available = self.available
-        try:
-            await self._device.update(type='usb')
-        except DeviceOffline:
-            if prev_available:
-                _LOGGER.warning('Device is offline %s', self.entity_id)
+        await self._coordinator.async_refresh()
 
 
 class KonkePowerStrip(object):
+    """Konke power strip shared by its outlet and usb entities.
 
-    def __init__(self, device, name: str):
+    The states of the sockets and usb ports are packed into the states
+    bitfield: socket i is bit i, usb port i is bit usb_shift + i.
+    """
+
+    __slots__ = ('_name', '_coordinator', '_device', 'entities', '_pending_sockets',
+                 '_pending_usb', '_flush', 'states', 'usb_shift', '_subscribers')
+
+    def __init__(self, coordinator, name: str):
         """Initialize the power strip."""
         self._name = name
-        self._device = device
-        self._last_update = 0
+        self._coordinator = coordinator
+        self._device = coordinator.device
+        self.entities = []
+        self._pending_sockets = {}
+        self._pending_usb = {}
+        self._flush = None
+        self.states = 0
+        self.usb_shift = coordinator.device.socket_count
+        self._subscribers = 0
 
     @property
     def available(self) -> bool:
         """Return True if outlet is available."""
         return self._device.is_online
 
+    @property
+    def circuit(self):
+        """Return the state of the circuit breaker."""
+        return self._coordinator.breaker.state
+
     @property
     def unique_id(self):
         """Return unique ID for outlet."""
@@ -219,31 +326,82 @@ class KonkePowerStrip(object):
 
     async def async_turn_on(self, index):
         """Instruct the outlet to turn on."""
-        await self._device.turn_on(index)
+        await self._async_set({index: True}, {})
 
     async def async_turn_off(self, index):
         """Instruct the outlet to turn off."""
-        await self._device.turn_off(index)
+        await self._async_set({index: False}, {})
 
     async def async_turn_on_usb(self, index):
         """Instruct the usb to turn on."""
-        await self._device.turn_on_usb(index)
+        await self._async_set({}, {index: True})
 
     async def async_turn_off_usb(self, index):
         """Instruct the outlet to turn off."""
-        await self._device.turn_off_usb(index)
+        await self._async_set({}, {index: False})
+
+    async def async_set_bitmap(self, sockets=None, usb=None):
+        """Set every socket and usb port from bitmaps, bit 0 is the first one."""
+        socket_changes = {}
+        usb_changes = {}
+        if sockets is not None:
+            socket_changes = {
+                index: bool(sockets >> index & 1)
+                for index in range(self._device.socket_count)}
+        if usb is not None:
+            usb_changes = {
+                index: bool(usb >> index & 1)
+                for index in range(getattr(self._device, 'usb_count', 0))}
+        await self._async_set(socket_changes, usb_changes)
+
+    async def _async_set(self, sockets, usb):
+        """Queue changes and wait until the batch containing them is sent."""
+        self._pending_sockets.update(sockets)
+        self._pending_usb.update(usb)
+        if self._flush is None:
+            self._flush = asyncio.ensure_future(self._async_flush())
+        await asyncio.shield(self._flush)
+
+    async def _async_flush(self):
+        """Send every change queued within the batch window at once."""
+        await asyncio.sleep(BATCH_WINDOW)
+        self._flush = None
+        sockets, self._pending_sockets = self._pending_sockets, {}
+        usb, self._pending_usb = self._pending_usb, {}
+
+        await self._coordinator.async_command(
+            None, lambda: async_set_power_strip(self._device, sockets, usb))
 
     async def async_update(self):
         """Synchronize state with power strip."""
-        from pykonkeio.error import DeviceOffline
-        prev_available = self.available
-        if time.time() - self._last_update >= UPDATE_DEBONCE:
-            self._last_update = time.time()
-            try:
-                await self._device.update()
-            except DeviceOffline:
-                if prev_available:
-                    _LOGGER.warning('Device is offline %s', self.unique_id)
+        await self._coordinator.async_refresh()
+
+    def _async_pack(self):
+        """Pack the socket and usb states of the device into states."""
+        states = 0
+        for index, status in enumerate(self._device.status):
+            if status == 'open':
+                states |= 1 << index
+        for index, status in enumerate(getattr(self._device, 'usb_status', ())):
+            if status == 'open':
+                states |= 1 << self.usb_shift + index
+        self.states = states
+
+    def async_add_listener(self, update_callback, fields=None):
+        """Subscribe an outlet callback to power strip updates."""
+        if not self._subscribers:
+            # Subscribed first, so the states are packed before outlets read them.
+            self._coordinator.async_add_listener(self._async_pack, ('status', 'usb_status'))
+            self._async_pack()
+        self._subscribers += 1
+        self._coordinator.async_add_listener(update_callback, fields)
+
+    def async_remove_listener(self, update_callback):
+        """Unsubscribe an outlet callback from power strip updates."""
+        self._coordinator.async_remove_listener(update_callback)
+        self._subscribers -= 1
+        if not self._subscribers:
+            self._coordinator.async_remove_listener(self._async_pack)
 
 
 class KonkePowerStripOutlet(SwitchDevice):
@@ -253,33 +411,41 @@ class KonkePowerStripOutlet(SwitchDevice):
         """Initialize the outlet."""
         self._powerstrip = powerstrip
         self._index = index
-        self._name = name
-        self._is_on = False
+        self._name = '%s_%s' % (name, index + 1)
+        self._unique_id = None
+        self._mask = 1 << index
 
     @property
     def should_poll(self) -> bool:
-        """Poll the plug."""
-        return True
+        """No polling needed, the power strip pushes updates."""
+        return False
 
     @property
     def available(self) -> bool:
         """Return True if outlet is available."""
         return self._powerstrip.available
 
+    @property
+    def device_state_attributes(self):
+        """Return the state of the circuit breaker."""
+        return {ATTR_CIRCUIT: self._powerstrip.circuit}
+
     @property
     def unique_id(self):
         """Return unique ID for outlet."""
-        return "%s:%s" % (self._powerstrip.unique_id, self._index + 1)
+        if self._unique_id is None and self._powerstrip.unique_id is not None:
+            self._unique_id = '%s:%s' % (self._powerstrip.unique_id, self._index + 1)
+        return self._unique_id
 
     @property
     def name(self):
         """Return the display name of this outlet."""
-        return '%s_%s' % (self._name, self._index + 1)
+        return self._name
 
     @property
     def is_on(self):
         """Return true if outlet is on."""
-        return self._powerstrip.get_status(self._index)
+        return self._powerstrip.states & self._mask != 0
 
     async def async_turn_on(self, **kwargs):
         """Instruct the outlet to turn on."""
@@ -291,6 +457,17 @@ class KonkePowerStripOutlet(SwitchDevice):
         await self._powerstrip.async_turn_off(self._index)
         _LOGGER.debug("Turn off outlet %s", self.unique_id)
 
+    async def async_added_to_hass(self):
+        """Subscribe to power strip updates."""
+        async_register_entity(self.hass, self)
+        self._powerstrip.async_add_listener(
+            self.async_schedule_update_ha_state, (('status', self._index),))
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from power strip updates."""
+        async_unregister_entity(self.hass, self)
+        self._powerstrip.async_remove_listener(self.async_schedule_update_ha_state)
+
     async def async_update(self):
         """Synchronize state with power strip."""
         await self._powerstrip.async_update()
@@ -303,32 +480,41 @@ class KonkePowerStripUSB(SwitchDevice):
         """Initialize the outlet."""
         self._powerstrip = powerstrip
         self._index = index
-        self._name = name
+        self._name = '%s_usb%s' % (name, index + 1)
+        self._unique_id = None
+        self._mask = 1 << powerstrip.usb_shift + index
 
     @property
     def should_poll(self) -> bool:
-        """Poll the plug."""
-        return True
+        """No polling needed, the power strip pushes updates."""
+        return False
 
     @property
     def available(self) -> bool:
         """Return True if outlet is available."""
         return self._powerstrip.available
 
+    @property
+    def device_state_attributes(self):
+        """Return the state of the circuit breaker."""
+        return {ATTR_CIRCUIT: self._powerstrip.circuit}
+
     @property
     def unique_id(self):
         """Return unique ID for outlet."""
-        return "%s:usb_%s" % (self._powerstrip.unique_id, self._index + 1)
+        if self._unique_id is None and self._powerstrip.unique_id is not None:
+            self._unique_id = '%s:usb_%s' % (self._powerstrip.unique_id, self._index + 1)
+        return self._unique_id
 
     @property
     def name(self):
         """Return the display name of this outlet."""
-        return '%s_usb%s' % (self._name, self._index + 1)
+        return self._name
 
     @property
     def is_on(self):
         """Return true if outlet is on."""
-        return self._powerstrip.get_usb_status(self._index)
+        return self._powerstrip.states & self._mask != 0
 
     async def async_turn_on(self, **kwargs):
         """Instruct the outlet to turn on."""
@@ -340,6 +526,17 @@ class KonkePowerStripUSB(SwitchDevice):
         await self._powerstrip.async_turn_off_usb(self._index)
         _LOGGER.debug("Turn off outlet %s", self.unique_id)
 
+    async def async_added_to_hass(self):
+        """Subscribe to power strip updates."""
+        async_register_entity(self.hass, self)
+        self._powerstrip.async_add_listener(
+            self.async_schedule_update_ha_state, (('usb_status', self._index),))
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from power strip updates."""
+        async_unregister_entity(self.hass, self)
+        self._powerstrip.async_remove_listener(self.async_schedule_update_ha_state)
+
     async def async_update(self):
         """Synchronize state with power strip."""
         await self._powerstrip.async_update()